@@ -30,7 +30,7 @@ class LeMonde(DataCollector):
     def parse_single_section(self, section, section_url):
         try:
             figure_url = section.figure.picture.source.get("data-srcset")
-            image = self.get_url_content(figure_url)
+            image = self.get_image(figure_url)
         except Exception:
             image = None
         title = section.h3.text.strip()
@@ -69,7 +69,7 @@ class LesEchos(DataCollector):
     def parse_single_section(self, section, section_url):
         try:
             figure_url = section.a.picture.img.get("src")
-            image = self.get_url_content(figure_url)
+            image = self.get_image(figure_url)
         except Exception:
             image = None
         title = section.h3.text.strip()
@@ -87,6 +87,8 @@ class LesEchos(DataCollector):
 
 @Registry.register(Archives.vinghtminutes)
 class VingthMinutes(DataCollector):
+    has_listing = True
+
     def __init__(self, begin_date, end_date, timeout):
         url_format = "https://www.20minutes.fr/archives/{date}"
         self._base_url = "https://www.20minutes.fr"
@@ -109,7 +111,7 @@ class VingthMinutes(DataCollector):
 
         try:
             figure_url = section_content.figure.img.get("src")
-            image = self.get_url_content(figure_url)
+            image = self.get_image(figure_url)
         except Exception:
             image = None
         title = section_content.h1.text.strip()
@@ -131,6 +133,8 @@ class VingthMinutes(DataCollector):
 
 @Registry.register(Archives.leparisien)
 class LeParisien(DataCollector):
+    has_listing = True
+
     def __init__(self, begin_date, end_date, timeout):
         url_format = "https://www.leparisien.fr/archives/{date}"
         self._base_url = "https://www.leparisien.fr"
@@ -143,13 +147,19 @@ class LeParisien(DataCollector):
     def get_section_url(self, section):
         return "https:" + section.get("href")
 
+    def get_listing_title(self, section):
+        return section.text.strip()
+
+    def get_listing_tag(self, section_url):
+        return self.get_url_tag(section_url, -2)
+
     def parse_single_section(self, section, section_url):
         url_content = self.get_url_content(section_url)
         section_content = BeautifulSoup(url_content, "html.parser")
 
         try:
             figure_url = self._base_url + section_content.section.img.get("src")
-            image = self.get_url_content(figure_url)
+            image = self.get_image(figure_url)
         except Exception:
             image = None
         title = section_content.h1.text.strip()
@@ -172,6 +182,8 @@ class LeParisien(DataCollector):
 
 @Registry.register(Archives.lepoint)
 class LePoint(DataCollector):
+    has_listing = True
+
     def __init__(self, begin_date, end_date, timeout):
         url_format = "https://www.lepoint.fr/archives/{date}.php"
         self._base_url = "https://www.lepoint.fr"
@@ -191,7 +203,7 @@ class LePoint(DataCollector):
 
         try:
             figure_url = section_content.figure.img.get("src")
-            image = self.get_url_content(figure_url)
+            image = self.get_image(figure_url)
         except Exception:
             image = None
         title = section_content.h1.text.strip()
@@ -214,6 +226,8 @@ class LePoint(DataCollector):
 
 @Registry.register(Archives.lorient)
 class LOrient(DataCollector):
+    has_listing = True
+
     def __init__(self, begin_date, end_date, timeout):
         url_format = "https://www.lorientlejour.com/seo.php?date={date}"
         self._base_url = "https://www.lorientlejour.com"
@@ -227,13 +241,16 @@ class LOrient(DataCollector):
     def get_section_url(self, section):
         return self._base_url + section.a.get("href")
 
+    def get_listing_tag(self, section_url):
+        return None
+
     def parse_single_section(self, section, section_url):
         url_content = self.get_url_content(section_url)
         section_content = BeautifulSoup(url_content, "html.parser")
 
         try:
             figure_url = section_content.select("div.image-container img")[0].get("src")
-            image = self.get_url_content(figure_url)
+            image = self.get_image(figure_url)
         except Exception:
             image = None
         title = section_content.h1.text.strip()
@@ -261,6 +278,8 @@ class LOrient(DataCollector):
 
 @Registry.register(Archives.rfi)
 class RFI(DataCollector):
+    has_listing = True
+
     def __init__(self, begin_date, end_date, timeout):
         url_format = "https://www.rfi.fr/fr/archives/{date}"
         self._base_url = "https://www.rfi.fr"
@@ -274,13 +293,16 @@ class RFI(DataCollector):
     def get_section_url(self, section):
         return self._base_url + section.a.get("href")
 
+    def get_listing_tag(self, section_url):
+        return self.get_url_tag(section_url, 1)
+
     def parse_single_section(self, section, section_url):
         url_content = self.get_url_content(section_url)
         section_content = BeautifulSoup(url_content, "html.parser")
 
         try:
             figure_url = section_content.figure.picture.img.get("src")
-            image = self.get_url_content(figure_url)
+            image = self.get_image(figure_url)
         except Exception:
             image = None
         title = section_content.h1.text.strip()
@@ -302,6 +324,8 @@ class RFI(DataCollector):
 
 @Registry.register(Archives.franceinfo)
 class FranceInfo(DataCollector):
+    has_listing = True
+
     def __init__(self, begin_date, end_date, timeout):
         url_format = "https://www.francetvinfo.fr/archives/{date}.html"
         self._base_url = "https://www.francetvinfo.fr/"
@@ -321,7 +345,7 @@ class FranceInfo(DataCollector):
 
         try:
             figure_url = section_content.figure.picture.img.get("src")
-            image = self.get_url_content(figure_url)
+            image = self.get_image(figure_url)
         except Exception:
             image = None
         title = section_content.h1.text.strip()
@@ -360,7 +384,7 @@ class LAlsace(DataCollector):
 
         try:
             figure_url = section_content.article.figure.a.get("href")
-            image = self.get_url_content(figure_url)
+            image = self.get_image(figure_url)
         except Exception:
             figure_url = image = None
 
@@ -400,7 +424,7 @@ class France24(DataCollector):
 
         try:
             figure_url = section_content.img.get("src")
-            image = self.get_url_content(figure_url)
+            image = self.get_image(figure_url)
         except Exception:
             figure_url = image = None
 
@@ -1,13 +1,23 @@
+import os
 import time
 import logging
+import itertools
 import argparse
 import numpy as np
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-from src.helpers.enum import DBCOLUMNS
-from src.utils.utils import alternate_elements
+from concurrent.futures import (
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+    FIRST_COMPLETED,
+)
+
+from src.helpers.enum import Archives, CrawlSchedules
+from src.utils.utils import round_robin
 from src.helpers.db_connector import DBConnector, DBManager
+from src.data_scrapping.frontier import CrawlFrontier
+from src.data_scrapping.scheduler import GapScheduler
+from src.data_scrapping.decorators import RemoveDoneDates
 from src.data_scrapping.collectors_registry import Registry
 
 
@@ -16,7 +26,14 @@ db_manager = DBManager()
 
 
 class CollectorsAggregator:
-    def __init__(self, name_list=None, **kwargs) -> None:
+    def __init__(
+        self,
+        name_list=None,
+        defer_images=None,
+        listing_only=None,
+        schedule=None,
+        **kwargs,
+    ) -> None:
         self.collectors = (
             Registry.create_list(name_list, **kwargs)
             if name_list
@@ -25,66 +42,139 @@ class CollectorsAggregator:
         assert (
             len(self.collectors) > 0
         ), f"Found {len(self.collectors)} collectors. Should have at least 1."
+        if defer_images is not None:
+            for collector in self.collectors:
+                collector.set_defer_images(defer_images)
+        if listing_only is not None:
+            for collector in self.collectors:
+                collector.set_listing_only(listing_only)
         self.workers = len(self.collectors)
+        self.frontier = CrawlFrontier()
+        self.schedule = schedule or os.getenv("CRAWL_SCHEDULE", CrawlSchedules.recent)
+        assert self.schedule in list(CrawlSchedules), f"Unknown schedule {schedule!r}"
+
+    @staticmethod
+    def prepare(name_list=None):
+        """
+        Create or migrate the tables and seed the crawl state of the archives.
+        Run once before the chunks of a collection, which only insert.
+        """
+        engine = db_manager.engine
+        DBConnector.create_table(engine, DBConnector.TABLE)
+        DBConnector.create_tags_table(engine, DBConnector.TABLE)
+        DBConnector.create_daily_table(engine, DBConnector.TABLE)
+        DBConnector.add_filter_indexes(engine, DBConnector.TABLE)
+        DBConnector.create_crawl_state_table(engine, DBConnector.CRAWL_STATE_TABLE)
+        for name in name_list or Registry.list_registered():
+            RemoveDoneDates.seed_crawl_state(Archives(name))
+
+    @staticmethod
+    def _get_collector_urls(collector):
+        for date, url in collector.get_all_urls():
+            yield collector, date, url
 
     def get_all_urls(self):
-        all_urls = []
-
-        for collector in self.collectors:
-            urls = collector.get_all_urls()
-            all_urls.append(urls)
-
-        all_urls = alternate_elements(all_urls)
-        assert len(all_urls) > 0, "No pages to collect"
-        return all_urls
+        """
+        Interleave the pages of the collectors, without listing them upfront,
+        or order them by coverage gap with the `gaps` schedule.
+        """
+        if self.schedule == CrawlSchedules.gaps:
+            return GapScheduler(self.collectors).schedule()
+        return round_robin(
+            *[self._get_collector_urls(collector) for collector in self.collectors]
+        )
 
     def parse_single_page(self, args):
-        date, url = args
-        for collector in self.collectors:
-            if collector.match_format(url):
-                collector.parse_single_page(date, url)
-                break
+        collector, date, url = args
+        return collector.archive, collector.parse_single_page(date, url) or 0
+
+    def push_to_frontier(self, urls):
+        dates = {collector.archive: [] for collector in self.collectors}
+        for collector, date, _ in urls:
+            dates[collector.archive].append(date)
+        for archive, archive_dates in dates.items():
+            pushed = self.frontier.push(archive, archive_dates)
+            logger.info(f"{pushed} dates of {archive} were added to the frontier")
+
+    def parse_pages(self, executor, urls):
+        """
+        Submit the pages as the workers become free, so the first pages are
+        fetched while the next ones are still being listed.
+        """
+        pending = set()
+        for args in urls:
+            if len(pending) >= 2 * self.workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from done
+            pending.add(executor.submit(self.parse_single_page, args))
+        yield from as_completed(pending)
+
+    def parse_from_frontier(self):
+        """Collect the dates leased from the frontier until it is empty."""
+        parsed = []
+        collectors = list(self.collectors)
+        while collectors:
+            for collector in list(collectors):
+                date = self.frontier.claim(collector.archive)
+                if date is None:
+                    collectors.remove(collector)
+                    continue
+                try:
+                    parsed.append(
+                        self.parse_single_page(
+                            (collector, date, collector.get_date_url(date))
+                        )
+                    )
+                finally:
+                    self.frontier.ack(collector.archive, date)
+        return parsed
 
     def run(self):
-        DBConnector.create_table(db_manager.engine, DBConnector.TABLE)
+        """
+        Collect the pages and return the number of rows this run inserted for
+        each archive. Other chunks of the same archive may insert meanwhile, so
+        the inserts are counted rather than the rows of the archive.
+        """
+        collected = {collector.archive.value: 0 for collector in self.collectors}
         urls = self.get_all_urls()
+        first = next(urls, None)
+        if first is None:
+            logger.info("No pages to collect")
+            return collected
+        urls = itertools.chain([first], urls)
 
-        count_before = {}
-        for collector in self.collectors:
-            name = collector.archive
-            count_before[name] = DBConnector.get_total_count(
-                db_manager.engine,
-                DBConnector.TABLE,
-                filters={DBCOLUMNS.archive: [("eq", name)]},
-            )
-            logger.info(
-                f"We already collected {count_before[name]} articles for {name} archive."
-            )
-
-        logger.info(f"Getting the data for {len(urls)} dates")
         start = time.time()
 
         with ThreadPoolExecutor(max_workers=self.workers) as executor:
-            futures = [executor.submit(self.parse_single_page, url) for url in urls]
-            for _ in tqdm(as_completed(futures), total=len(futures), desc="Scraping"):
-                pass
-
+            if self.frontier.enabled:
+                self.push_to_frontier(urls)
+                futures = [
+                    executor.submit(self.parse_from_frontier)
+                    for _ in range(self.workers)
+                ]
+                results = [
+                    result
+                    for future in tqdm(
+                        as_completed(futures), total=len(futures), desc="Scraping"
+                    )
+                    for result in future.result()
+                ]
+            else:
+                futures = self.parse_pages(executor, urls)
+                results = [future.result() for future in tqdm(futures, desc="Scraping")]
+
+        logger.info(f"Got the data for {len(results)} pages")
         end = np.round((time.time() - start) / 60, 2)
 
-        for collector in self.collectors:
-            name = collector.archive
-            rows_nb = DBConnector.get_total_count(
-                db_manager.engine,
-                DBConnector.TABLE,
-                filters={DBCOLUMNS.archive: [("eq", name)]},
-            )
-            diff = rows_nb - count_before[name]
+        for archive, inserted in results:
+            collected[archive.value] += inserted
+        for name, inserted in collected.items():
             logger.info(
-                f"\nFor {name}:\n"
-                f"{diff} sections were collected in {end} min. "
-                f"We have in total {rows_nb} sections."
+                f"\nFor {name}:\n{inserted} sections were collected in {end} min."
             )
 
+        return collected
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -94,8 +184,28 @@ if __name__ == "__main__":
     )
     parser.add_argument("-e", "--end_date", type=str, required=True, help="end date")
     parser.add_argument("-t", "--timeout", type=float, required=True, help="timeout")
+    parser.add_argument(
+        "--defer_images",
+        action="store_true",
+        default=None,
+        help="only store the image urls, images are fetched later",
+    )
+    parser.add_argument(
+        "--listing_only",
+        action="store_true",
+        default=None,
+        help="only store what the listing pages provide, articles are enriched later",
+    )
+    parser.add_argument(
+        "--schedule",
+        type=str,
+        choices=[schedule.value for schedule in CrawlSchedules],
+        default=None,
+        help="most recent pages first, or largest coverage gaps first",
+    )
     args = parser.parse_args()
 
     print(vars(args))
     aggregator = CollectorsAggregator(**vars(args))
+    CollectorsAggregator.prepare()
     aggregator.run()
@@ -18,9 +18,14 @@ class Registry:
         del cls._registry[name]
 
     @classmethod
-    def create(cls, name, *args, **kwargs):
+    def create_base(cls, name, *args, **kwargs):
+        """Create the collector without the decorators skipping done dates"""
         assert name in cls._registry, f"Class '{name}' is not registered."
-        collector = cls._registry[name](*args, **kwargs)
+        return cls._registry[name](*args, **kwargs)
+
+    @classmethod
+    def create(cls, name, *args, **kwargs):
+        collector = cls.create_base(name, *args, **kwargs)
         collector = AddPages(collector)
         collector = RemoveDoneDates(collector)
         return collector
@@ -2,12 +2,19 @@ import re
 import os
 import logging
 import dateparser
-import pandas as pd
 from bs4 import BeautifulSoup
+from urllib.parse import urlparse
 from abc import ABC, abstractmethod
 from datetime import datetime, timedelta, date
 
-from src.helpers.enum import DBCOLUMNS
+from src.helpers.enum import (
+    DBCOLUMNS,
+    CRAWLCOLUMNS,
+    CrawlStatus,
+    OPERATORS,
+    ResultModes,
+)
+from src.data_scrapping.frontier import CrawlFrontier
 from src.data_scrapping.strategy import StrategyFactory
 from src.helpers.db_connector import DBConnector, DBManager
 from src.utils.utils import save_image, get_image_path, get_embeddings
@@ -18,26 +25,34 @@ db_manager = DBManager()
 
 class DataCollector(ABC):
     BATCH_EMBEDDING = 32
+    # visits of an empty listing before its date is considered done
+    MAX_EMPTY_VISITS = int(os.getenv("MAX_EMPTY_VISITS", 3))
+    # True when the listing pages provide the titles, see `parse_listing_section`
+    has_listing = False
 
     def __init__(self, url_format, date2str, begin_date, end_date, timeout):
         super().__init__()
         self.url_format = url_format
         self.date2str = date2str
-        self.begin_date = self._convert_to_date(begin_date)
+        self.begin_date = self.convert_to_date(begin_date)
         self.begin_date = max(self.begin_date, self.min_date)
-        self.end_date = self._convert_to_date(end_date)
+        self.end_date = self.convert_to_date(end_date)
         self.timeout = timeout
         self._translation_table = str.maketrans("éàèùâêîôûç", "eaeuaeiouc")
         self._fetch_strategy = StrategyFactory(self)
+        self._frontier = CrawlFrontier()
         self._data_dir = "/images/"
         self._embedding_url = os.getenv("EMBED_URL")
+        self.defer_images = os.getenv("DEFER_IMAGES", "false").lower() == "true"
+        self.listing_only = os.getenv("LISTING_ONLY", "false").lower() == "true"
 
     def match_format(self, url):
         return bool(
             re.match(self.url_format.replace("?", "\?").format(date=".*", page=""), url)
         )
 
-    def _convert_to_date(self, str_date):
+    @staticmethod
+    def convert_to_date(str_date):
         if str_date is not None:
             if isinstance(str_date, date):
                 return str_date
@@ -45,69 +60,183 @@ class DataCollector(ABC):
         return datetime.now().date()
 
     def get_all_urls(self):
-        all_dates = []
-        for day in range((self.end_date - self.begin_date + timedelta(days=1)).days):
-            date = self.begin_date + timedelta(days=day)
-            all_dates.append(date)
-
-        all_urls = [
-            (
-                date,
-                self.url_format.format(
-                    date=self.date2str(date).translate(self._translation_table),
-                    page="{page}",
-                ),
-            )
-            for date in all_dates
-        ]
-        df = pd.DataFrame(all_urls, columns=["date", "str_format"])
-        return df.drop_duplicates("str_format").values[::-1].tolist()
+        """
+        Yield the (date, url) pages from the most recent date. Consecutive dates
+        sharing a page (monthly archives...) are yielded once, with the earliest
+        date of the range.
+        """
+        page = None
+        day = self.end_date
+        while day >= self.begin_date:
+            url = self.get_date_url(day)
+            if page is not None and url != page[1]:
+                yield page
+            page = (day, url)
+            day -= timedelta(days=1)
+        if page is not None:
+            yield page
+
+    def get_date_url(self, date):
+        return self.url_format.format(
+            date=self.date2str(date).translate(self._translation_table),
+            page="{page}",
+        )
 
     def get_url_content(self, url):
         return self._fetch_strategy.get_url_content(url)
 
+    def set_defer_images(self, defer_images):
+        self.defer_images = defer_images
+
+    def set_listing_only(self, listing_only):
+        self.listing_only = listing_only
+
+    def get_image(self, image_url):
+        """Download the image, or only keep its url when images are deferred."""
+        if self.defer_images:
+            return image_url
+        return self.get_url_content(image_url)
+
     def get_sections(self, url):
         content = self.get_url_content(url.format(page=""))
         parsed_content = BeautifulSoup(content, "html.parser")
         sections = parsed_content.select(self.content_selector)
         return sections, parsed_content
 
+    def parse_section(self, section, section_url):
+        """Parse the listing section alone in listing-only mode, when possible."""
+        if self.listing_only:
+            data = self.parse_listing_section(section, section_url)
+            if data is not None:
+                return data
+        return self.parse_single_section(section, section_url)
+
+    def parse_listing_section(self, section, section_url):
+        """Data available on the listing page, None when the article page is needed."""
+        if not self.has_listing:
+            return None
+        return {
+            DBCOLUMNS.image: None,
+            DBCOLUMNS.title: self.get_listing_title(section),
+            DBCOLUMNS.content: None,
+            DBCOLUMNS.tag: self.get_listing_tag(section_url),
+            DBCOLUMNS.archive: self.archive,
+        }
+
+    def get_listing_title(self, section):
+        return section.a.text.strip()
+
+    def get_listing_tag(self, section_url):
+        return self.get_url_tag(section_url)
+
+    @staticmethod
+    def get_url_tag(section_url, position=0):
+        try:
+            return urlparse(section_url).path.strip("/").split("/")[position] or None
+        except IndexError:
+            return None
+
+    def prepare_data(self, data, date, section_url):
+        data[DBCOLUMNS.date] = date
+        data[DBCOLUMNS.link] = section_url
+        if not self.defer_images:
+            img_path = get_image_path(self._data_dir, date, section_url)
+            img_path = save_image(img_path, data[DBCOLUMNS.image])
+            data[DBCOLUMNS.image] = img_path
+        return data
+
     def parse_single_page(self, date, url):
+        state = {
+            CRAWLCOLUMNS.archive: self.archive,
+            CRAWLCOLUMNS.date: date,
+            CRAWLCOLUMNS.status: CrawlStatus.done,
+            CRAWLCOLUMNS.sections: 0,
+            CRAWLCOLUMNS.articles: 0,
+            CRAWLCOLUMNS.empty_visits: 0,
+            CRAWLCOLUMNS.error: None,
+            CRAWLCOLUMNS.started_at: datetime.now(),
+        }
         try:
             sections, _ = self.get_sections(url)
             logger.debug(f"Page {url} contains {len(sections)} sections")
+            state[CRAWLCOLUMNS.sections] = len(sections)
             data_list = []
             for section in sections:
                 try:
                     section_url = self.get_section_url(section)
+                    if section_url is not None and self._is_seen(section_url):
+                        continue
                     if section_url is not None:
-                        data = self.parse_single_section(section, section_url)
-
-                        data[DBCOLUMNS.date] = date
-                        data[DBCOLUMNS.link] = section_url
-                        img_path = get_image_path(self._data_dir, date, section_url)
-                        img_path = save_image(img_path, data[DBCOLUMNS.image])
-                        data[DBCOLUMNS.image] = img_path
-                        data_list.append(data)
+                        data = self.parse_section(section, section_url)
+                        data_list.append(self.prepare_data(data, date, section_url))
 
                         if len(data_list) >= DataCollector.BATCH_EMBEDDING:
-                            self.insert_batch(data_list)
+                            state[CRAWLCOLUMNS.articles] += self.insert_batch(data_list)
                             data_list = []
 
                 except Exception as e:
                     logger.debug(f"Exception in parsing section from page {url}")
                     logger.debug(e)
                     if len(data_list) >= DataCollector.BATCH_EMBEDDING:
-                        self.insert_batch(data_list)
+                        state[CRAWLCOLUMNS.articles] += self.insert_batch(data_list)
                         data_list = []
 
             if len(data_list) > 0:
-                self.insert_batch(data_list)
+                state[CRAWLCOLUMNS.articles] += self.insert_batch(data_list)
                 data_list = []
 
         except Exception as e:
             logger.debug(f"Exception in parsing page {url}")
             logger.debug(e)
+            state[CRAWLCOLUMNS.status] = CrawlStatus.failed
+            state[CRAWLCOLUMNS.error] = str(e)[:1000]
+
+        if state[CRAWLCOLUMNS.status] == CrawlStatus.done:
+            if not state[CRAWLCOLUMNS.sections]:
+                # an empty listing may be a changed or throttled page, it is
+                # fetched again until it was empty MAX_EMPTY_VISITS times
+                visits = self.get_empty_visits(date) + 1
+                state[CRAWLCOLUMNS.empty_visits] = visits
+                if visits < self.MAX_EMPTY_VISITS:
+                    state[CRAWLCOLUMNS.status] = CrawlStatus.partial
+                    state[CRAWLCOLUMNS.error] = "no sections were found"
+            elif date >= datetime.now().date():
+                # articles are still being published for the current day
+                state[CRAWLCOLUMNS.status] = CrawlStatus.partial
+        self.save_crawl_state(state)
+        return state[CRAWLCOLUMNS.articles]
+
+    def get_empty_visits(self, date):
+        try:
+            visits = DBConnector.get_all_rows(
+                db_manager.engine,
+                DBConnector.CRAWL_STATE_TABLE,
+                filters={
+                    CRAWLCOLUMNS.archive: [(OPERATORS.eq, self.archive)],
+                    CRAWLCOLUMNS.date: [(OPERATORS.eq, date)],
+                },
+                columns=[CRAWLCOLUMNS.empty_visits],
+                result_mode=ResultModes.scalar,
+            )
+        except Exception as e:
+            logger.error(f"Failed to read the crawl state of {date}: {e}")
+            visits = None
+        return visits or 0
+
+    def save_crawl_state(self, state):
+        state[CRAWLCOLUMNS.finished_at] = datetime.now()
+        try:
+            DBConnector.save_crawl_state(
+                db_manager.engine, DBConnector.CRAWL_STATE_TABLE, state
+            )
+        except Exception as e:
+            logger.error(f"Failed to save the crawl state of {state}: {e}")
+
+    def _is_seen(self, section_url):
+        """Check if another node stored the link since the done links were loaded"""
+        return self._frontier.enabled and self._frontier.is_seen(
+            self.archive, section_url
+        )
 
     def insert_batch(self, data_list):
         list_ = []
@@ -117,15 +246,20 @@ class DataCollector(ABC):
                 data[DBCOLUMNS.embedding] = emb
                 list_.append(data)
 
-            rowscount = DBConnector.insert_row(
+            rowscount = DBConnector.insert_rows_binary(
                 db_manager.engine, DBConnector.TABLE, list_
             )
         else:
-            rowscount = DBConnector.insert_row(
+            rowscount = DBConnector.insert_rows_binary(
                 db_manager.engine, DBConnector.TABLE, data_list
             )
 
+        if self._frontier.enabled:
+            self._frontier.add_seen(
+                self.archive, [data[DBCOLUMNS.link] for data in data_list]
+            )
         logger.info(f"{rowscount} were inserted into the database")
+        return rowscount or 0
 
     @abstractmethod
     def get_section_url(self, section):
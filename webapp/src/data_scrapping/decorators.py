@@ -1,6 +1,8 @@
 import logging
-import pandas as pd
-from src.helpers.enum import DBCOLUMNS
+import threading
+import numpy as np
+from src.helpers.enum import DBCOLUMNS, CRAWLCOLUMNS, CrawlStatus, ResultModes
+from src.utils.utils import pg_hashtext
 from src.helpers.db_connector import DBConnector, DBManager
 from src.data_scrapping.data_collector import DataCollector
 
@@ -27,9 +29,20 @@ class Decorator(DataCollector):
     def get_all_urls(self):
         return self._collector.get_all_urls()
 
+    def get_date_url(self, date):
+        return self._collector.get_date_url(date)
+
     def get_url_content(self, url):
         return self._collector.get_url_content(url)
 
+    def set_defer_images(self, defer_images):
+        self.defer_images = defer_images
+        self._collector.set_defer_images(defer_images)
+
+    def set_listing_only(self, listing_only):
+        self.listing_only = listing_only
+        self._collector.set_listing_only(listing_only)
+
     def get_sections(self, url):
         return self._collector.get_sections(url)
 
@@ -39,6 +52,9 @@ class Decorator(DataCollector):
     def parse_single_section(self, section, section_url):
         return self._collector.parse_single_section(section, section_url)
 
+    def parse_listing_section(self, section, section_url):
+        return self._collector.parse_listing_section(section, section_url)
+
     def get_section_url(self, section):
         return self._collector.get_section_url(section)
 
@@ -87,32 +103,108 @@ class RemoveDoneDates(Decorator):
         }
         done_dates = DBConnector.get_done_dates(
             db_manager.engine,
-            DBConnector.TABLE,
+            DBConnector.CRAWL_STATE_TABLE,
             filters=self._filters,
         )
         done_dates = done_dates if done_dates is not None else []
         self._done_dates = done_dates if isinstance(done_dates, list) else [done_dates]
-        self._done_urls = None
+        self._done_hashes = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def seed_crawl_state(archive):
+        """Mark the dates collected before the crawl state existed as done."""
+        archive_filter = {DBCOLUMNS.archive: [("eq", archive)]}
+        has_state = DBConnector.get_total_count(
+            db_manager.engine,
+            DBConnector.CRAWL_STATE_TABLE,
+            archive_filter,
+            result_mode=ResultModes.scalar,
+        )
+        if has_state:
+            return
 
-    def get_all_urls(self):
-        all_urls = super().get_all_urls()
-        done_dates = list(zip(self._done_dates, [None] * len(self._done_dates)))
+        done_dates = DBConnector.estimate_done_dates(
+            db_manager.engine,
+            DBConnector.TABLE,
+            filters=archive_filter,
+            result_mode=ResultModes.frame,
+        )
+        if done_dates is None or done_dates.empty:
+            return
 
-        df = pd.DataFrame(all_urls + done_dates, columns=["date", "str_format"])
-        return df.drop_duplicates("date", keep=False).dropna().values[::-1].tolist()
+        DBConnector.save_crawl_state(
+            db_manager.engine,
+            DBConnector.CRAWL_STATE_TABLE,
+            [
+                {
+                    CRAWLCOLUMNS.archive: archive,
+                    CRAWLCOLUMNS.date: date,
+                    CRAWLCOLUMNS.status: CrawlStatus.done,
+                }
+                for date in done_dates["date"]
+            ],
+        )
+        logger.info(f"{archive}: {len(done_dates)} dates were marked as done")
+
+    def get_all_urls(self):
+        done_dates = set(self._done_dates)
+        for date, url in super().get_all_urls():
+            if date not in done_dates:
+                yield date, url
 
     def _lazy_load_urls(self):
-        if self._done_urls is None:
-            done_urls = DBConnector.get_all_rows(
+        """
+        Load the `hash` column of the archive into a sorted int64 array.
+        The hash is `hashtext(link)` and is unique, so checking it is enough
+        to know if a link would be a duplicate.
+        """
+        with self._lock:
+            if self._done_hashes is not None:
+                return
+
+            batches = DBConnector.get_all_rows(
                 db_manager.engine,
                 DBConnector.TABLE,
                 filters=self._filters,
-                columns=[DBCOLUMNS.link],
+                columns=[DBCOLUMNS.hash],
+                result_mode=ResultModes.stream,
             )
-            self._done_urls = set(done_urls) if done_urls else set()
-            logger.info(f"{self._collector.archive}: {len(self._done_urls)}")
+            hashes = [np.asarray(batch, dtype=np.int64) for batch in batches or []]
+            self._done_hashes = (
+                np.unique(np.concatenate(hashes)) if hashes else np.empty(0, np.int64)
+            )
+            self._check_hashes()
+            logger.info(f"{self._collector.archive}: {len(self._done_hashes)}")
 
-    def get_section_url(self, section):
+    def _check_hashes(self):
+        sample = DBConnector.fetch_data_keyset(
+            db_manager.engine,
+            DBConnector.TABLE,
+            columns=[DBCOLUMNS.link, DBCOLUMNS.hash],
+            limit=10,
+            filters=self._filters,
+            result_mode=ResultModes.frame,
+        )
+        if sample is None:
+            return
+        for link, hash_ in sample.itertuples(index=False):
+            if pg_hashtext(link) != hash_:
+                logger.warning(
+                    f"{self._collector.archive}: the link hashes don't match the "
+                    "database, done links won't be skipped."
+                )
+                self._done_hashes = np.empty(0, np.int64)
+                return
+
+    def is_done(self, section_url):
         self._lazy_load_urls()
+        key = pg_hashtext(section_url)
+        position = np.searchsorted(self._done_hashes, key)
+        return position < len(self._done_hashes) and self._done_hashes[position] == key
+
+    def get_section_url(self, section):
         section_url = super().get_section_url(section)
-        return section_url if section_url not in self._done_urls else None
+        if section_url is None or self.is_done(section_url):
+            return None
+        return section_url
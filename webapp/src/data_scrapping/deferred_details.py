@@ -0,0 +1,117 @@
+import os
+import logging
+
+from src.utils.utils import get_embeddings
+from src.helpers.enum import DBCOLUMNS, OPERATORS
+from src.helpers.db_connector import DBConnector, DBManager
+from src.helpers.query_cache import QueryCache
+from src.data_scrapping.collectors_registry import Registry
+
+
+logger = logging.getLogger(__name__)
+db_manager = DBManager()
+
+
+class DeferredDetails:
+    """
+    In listing-only mode, collectors store what the archive listing provides
+    (link, title and sometimes a tag) without fetching each article page,
+    so their rows have no content. The enrichment fetches the article pages
+    later, then updates the rows and their embeddings. The content of the
+    articles that could not be fetched is set to an empty string, so they
+    are not fetched again by the next backfills.
+    """
+
+    BATCH = 32
+    COLUMNS = [DBCOLUMNS.rowid, DBCOLUMNS.date, DBCOLUMNS.link, DBCOLUMNS.tag]
+
+    @classmethod
+    def _enrich(cls, collector, rows):
+        batch = []
+        for rowid, date, link, tag in rows:
+            try:
+                data = collector.parse_single_section(None, link)
+                data = collector.prepare_data(data, date, link)
+            except Exception as e:
+                logger.debug(f"Failed to enrich {link}")
+                logger.debug(e)
+                DBConnector.update_row(
+                    db_manager.engine,
+                    DBConnector.TABLE,
+                    rowid,
+                    {DBCOLUMNS.content: ""},
+                    date=date,
+                    archive=collector.archive,
+                    bump=False,
+                )
+                continue
+            data[DBCOLUMNS.rowid] = rowid
+            data[DBCOLUMNS.tag] = data[DBCOLUMNS.tag] or tag
+            batch.append(data)
+
+        if not batch:
+            return 0
+
+        embeddings = get_embeddings(batch, os.getenv("EMBED_URL"))
+        for index, data in enumerate(batch):
+            values = {
+                column: data[column]
+                for column in [
+                    DBCOLUMNS.image,
+                    DBCOLUMNS.title,
+                    DBCOLUMNS.content,
+                    DBCOLUMNS.tag,
+                ]
+            }
+            if embeddings is not None:
+                values[DBCOLUMNS.embedding] = embeddings[index]
+            DBConnector.update_row(
+                db_manager.engine,
+                DBConnector.TABLE,
+                data[DBCOLUMNS.rowid],
+                values,
+                date=data[DBCOLUMNS.date],
+                archive=collector.archive,
+                bump=False,
+            )
+        return len(batch)
+
+    @classmethod
+    def backfill(cls, filters=None):
+        filters = dict(filters) if filters else {}
+        archive_ops = filters.pop(DBCOLUMNS.archive, [])
+        archives = archive_ops[0][1] if archive_ops else Registry.list_registered()
+        filters[DBCOLUMNS.content] = [(OPERATORS.isnull, None)]
+
+        enriched = 0
+        for archive in archives:
+            collector = Registry.create_base(
+                archive, begin_date=None, end_date=None, timeout=10
+            )
+            # the other collectors always fetch the article pages
+            if not collector.has_listing:
+                continue
+            archive_filters = {
+                **filters,
+                DBCOLUMNS.archive: [(OPERATORS.eq, collector.archive)],
+            }
+            last_seen = None
+            while True:
+                rows = DBConnector.fetch_data_keyset(
+                    db_manager.engine,
+                    DBConnector.TABLE,
+                    last_seen_value=last_seen,
+                    limit=cls.BATCH,
+                    filters=archive_filters,
+                    columns=cls.COLUMNS,
+                )
+                if not rows:
+                    break
+
+                enriched += cls._enrich(collector, rows)
+                last_seen = {DBCOLUMNS.date: rows[-1][1], DBCOLUMNS.rowid: rows[-1][0]}
+                logger.info(f"{enriched} articles were enriched")
+
+        if enriched:
+            QueryCache().bump(DBConnector.TABLE)
+        return enriched
@@ -0,0 +1,73 @@
+import os
+import logging
+
+from src.utils.utils import get_embeddings
+from src.helpers.enum import DBCOLUMNS, OPERATORS
+from src.helpers.db_connector import DBConnector, DBManager
+from src.helpers.query_cache import QueryCache
+
+
+logger = logging.getLogger(__name__)
+db_manager = DBManager()
+
+
+class DeferredEmbeddings:
+    """
+    Articles are inserted without embedding when the embedding service fails.
+    The backfill computes the missing embeddings once the service is back.
+    """
+
+    BATCH = 32
+    COLUMNS = [
+        DBCOLUMNS.rowid,
+        DBCOLUMNS.date,
+        DBCOLUMNS.title,
+        DBCOLUMNS.content,
+        DBCOLUMNS.tag,
+        DBCOLUMNS.archive,
+    ]
+
+    @classmethod
+    def backfill(cls, filters=None):
+        filters = dict(filters) if filters else {}
+        filters[DBCOLUMNS.embedding] = [(OPERATORS.isnull, None)]
+        embedding_url = os.getenv("EMBED_URL")
+
+        updated = 0
+        last_seen = None
+        while True:
+            rows = DBConnector.fetch_data_keyset(
+                db_manager.engine,
+                DBConnector.TABLE,
+                last_seen_value=last_seen,
+                limit=cls.BATCH,
+                filters=filters,
+                columns=cls.COLUMNS,
+            )
+            if not rows:
+                break
+
+            batch = [dict(zip(cls.COLUMNS, row)) for row in rows]
+            embeddings = get_embeddings(batch, embedding_url)
+            if embeddings is None:
+                logger.error("The embedding service failed, stopping the backfill")
+                break
+
+            for data, embedding in zip(batch, embeddings):
+                DBConnector.update_row(
+                    db_manager.engine,
+                    DBConnector.TABLE,
+                    data[DBCOLUMNS.rowid],
+                    {DBCOLUMNS.embedding: embedding},
+                    date=data[DBCOLUMNS.date],
+                    archive=data[DBCOLUMNS.archive],
+                    bump=False,
+                )
+            updated += len(batch)
+
+            last_seen = {DBCOLUMNS.date: rows[-1][1], DBCOLUMNS.rowid: rows[-1][0]}
+            logger.info(f"{updated} missing embeddings were computed")
+
+        if updated:
+            QueryCache().bump(DBConnector.TABLE)
+        return updated
@@ -0,0 +1,133 @@
+import os
+import logging
+import threading
+
+from src.helpers.enum import DBCOLUMNS, OPERATORS
+from src.data_scrapping.strategy import RequestsFetchStrategy
+from src.helpers.redis_manager import RedisManager
+from src.helpers.db_connector import DBConnector, DBManager
+from src.helpers.query_cache import QueryCache
+from src.utils.utils import save_image, get_image_path
+
+
+logger = logging.getLogger(__name__)
+db_manager = DBManager()
+
+
+class DeferredImages:
+    """
+    When a collection runs with deferred images, only the image url is stored in
+    the image column. The image is then fetched by the low priority background
+    task, or queued on the same workers the first time its card is shown, and
+    the row is updated to point to the cached file. The url is kept when the
+    image can't be fetched, and dropped after MAX_ATTEMPTS failed fetches.
+    """
+
+    BATCH = 500
+    # seconds before a card shown again queues the same image again
+    QUEUED_TTL = 600
+    MAX_ATTEMPTS = int(os.getenv("MAX_IMAGE_ATTEMPTS", 3))
+    # seconds before the failed fetches of an image are forgotten
+    FAILURES_TTL = 7 * 24 * 3600
+    DATA_DIR = "/images/"
+    _fetcher = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def is_deferred(image):
+        return isinstance(image, str) and image.startswith(("http://", "https://"))
+
+    @classmethod
+    def _get_fetcher(cls):
+        with cls._lock:
+            if cls._fetcher is None:
+                cls._fetcher = RequestsFetchStrategy()
+        return cls._fetcher
+
+    @classmethod
+    def claim(cls, rowid):
+        """True when the image of `rowid` was not queued in the last QUEUED_TTL."""
+        try:
+            return bool(
+                RedisManager().client.set(
+                    f"deferred_image:{rowid}", 1, nx=True, ex=cls.QUEUED_TTL
+                )
+            )
+        except Exception as e:
+            logger.debug(f"Failed to claim the deferred image of {rowid}: {e}")
+            return True
+
+    @classmethod
+    def count_failure(cls, rowid):
+        """Number of failed fetches of the image of `rowid`, this one included."""
+        key = f"deferred_image_failures:{rowid}"
+        try:
+            client = RedisManager().client
+            failures = client.incr(key)
+            client.expire(key, cls.FAILURES_TTL)
+            return failures
+        except Exception as e:
+            logger.debug(f"Failed to count the failures of the image of {rowid}: {e}")
+            return 0
+
+    @classmethod
+    def fetch(cls, rowid, image_url, date, link, archive=None):
+        try:
+            image_bytes = cls._get_fetcher().get_url_content(image_url)
+            img_path = get_image_path(cls.DATA_DIR, date, link)
+            img_path = save_image(img_path, image_bytes)
+        except Exception as e:
+            logger.debug(f"Failed to fetch the deferred image {image_url}")
+            logger.debug(e)
+            if cls.count_failure(rowid) < cls.MAX_ATTEMPTS:
+                return None
+            img_path = None
+
+        # the cached pages showing the url expire with their TTL, the backfill
+        # invalidates them once it is done
+        DBConnector.update_row(
+            db_manager.engine,
+            DBConnector.TABLE,
+            rowid,
+            {DBCOLUMNS.image: img_path},
+            date=date,
+            archive=archive,
+            bump=False,
+        )
+        return img_path
+
+    @classmethod
+    def backfill(cls, filters=None):
+        filters = dict(filters) if filters else {}
+        filters[DBCOLUMNS.image] = [(OPERATORS.like, "http%")]
+
+        fetched = 0
+        last_seen = None
+        while True:
+            rows = DBConnector.fetch_data_keyset(
+                db_manager.engine,
+                DBConnector.TABLE,
+                last_seen_value=last_seen,
+                limit=cls.BATCH,
+                filters=filters,
+                columns=[
+                    DBCOLUMNS.rowid,
+                    DBCOLUMNS.date,
+                    DBCOLUMNS.image,
+                    DBCOLUMNS.link,
+                    DBCOLUMNS.archive,
+                ],
+            )
+            if not rows:
+                break
+
+            for rowid, date, image_url, link, archive in rows:
+                if cls.fetch(rowid, image_url, date, link, archive):
+                    fetched += 1
+
+            last_seen = {DBCOLUMNS.date: rows[-1][1], DBCOLUMNS.rowid: rows[-1][0]}
+            logger.info(f"{fetched} deferred images were fetched")
+
+        if fetched:
+            QueryCache().bump(DBConnector.TABLE)
+        return fetched
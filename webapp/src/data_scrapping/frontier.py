@@ -0,0 +1,167 @@
+import os
+import time
+import logging
+from datetime import date
+from urllib.parse import urlparse
+
+from src.utils.utils import pg_hashtext
+from src.helpers.redis_manager import RedisManager
+
+
+logger = logging.getLogger(__name__)
+
+PUSH_SCRIPT = """
+local pushed = 0
+for _, item in ipairs(ARGV) do
+    if redis.call('SADD', KEYS[1], item) == 1 then
+        redis.call('RPUSH', KEYS[2], item)
+        pushed = pushed + 1
+    end
+end
+return pushed
+"""
+
+CLAIM_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now_ms)
+for _, item in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], item)
+    redis.call('RPUSH', KEYS[1], item)
+end
+local item = redis.call('LPOP', KEYS[1])
+if item then
+    redis.call('ZADD', KEYS[2], now_ms + tonumber(ARGV[1]), item)
+end
+return item
+"""
+
+POLITENESS_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local slot = tonumber(redis.call('GET', KEYS[1]) or now_ms)
+if slot < now_ms then
+    slot = now_ms
+end
+local next_slot = slot + tonumber(ARGV[1])
+redis.call('SET', KEYS[1], next_slot, 'PX', next_slot - now_ms + 1000)
+return slot - now_ms
+"""
+
+
+class CrawlFrontier:
+    """
+    Coordinates the collectors running on several nodes through redis.
+
+    - Work items are (archive, date) pairs. A date pushed by several nodes is
+      queued once, and a claimed date is leased: if the node does not ack it
+      before `LEASE_SECONDS`, the date is handed out again.
+    - The hashes of the links stored by any node are kept in a shared set,
+      so a link is not fetched again before the local done links are reloaded.
+    - Requests to the same host are spaced by `HOST_DELAY` seconds across all
+      the nodes.
+    """
+
+    PREFIX = "frontier"
+    LEASE_SECONDS = int(os.getenv("FRONTIER_LEASE_SECONDS", 900))
+    SEEN_TTL = int(os.getenv("FRONTIER_SEEN_TTL", 7 * 24 * 3600))
+    HOST_DELAY = float(os.getenv("FRONTIER_HOST_DELAY", 0.5))
+    _scripts = None
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(CrawlFrontier, cls).__new__(cls)
+        return cls._instance
+
+    @property
+    def enabled(self):
+        return os.getenv("CRAWL_FRONTIER", "false").lower() == "true"
+
+    @property
+    def client(self):
+        return RedisManager().client
+
+    @property
+    def scripts(self):
+        if self._scripts is None:
+            self._scripts = {
+                "push": self.client.register_script(PUSH_SCRIPT),
+                "claim": self.client.register_script(CLAIM_SCRIPT),
+                "politeness": self.client.register_script(POLITENESS_SCRIPT),
+            }
+        return self._scripts
+
+    def _key(self, *parts):
+        return ":".join([self.PREFIX, *[str(part) for part in parts]])
+
+    @staticmethod
+    def _archive(archive):
+        return getattr(archive, "value", archive)
+
+    def push(self, archive, dates):
+        """Queue the dates of the archive that are not queued or leased yet."""
+        archive = self._archive(archive)
+        items = [day.isoformat() for day in dates]
+        if not items:
+            return 0
+        return self.scripts["push"](
+            keys=[self._key(archive, "pending"), self._key(archive, "queue")],
+            args=items,
+        )
+
+    def claim(self, archive):
+        """Lease the next date of the archive, None when the queue is empty."""
+        archive = self._archive(archive)
+        item = self.scripts["claim"](
+            keys=[self._key(archive, "queue"), self._key(archive, "leases")],
+            args=[self.LEASE_SECONDS * 1000],
+        )
+        if item is None:
+            return None
+        return date.fromisoformat(item.decode("utf-8"))
+
+    def ack(self, archive, day):
+        archive = self._archive(archive)
+        item = day.isoformat()
+        pipeline = self.client.pipeline()
+        pipeline.zrem(self._key(archive, "leases"), item)
+        pipeline.lrem(self._key(archive, "queue"), 0, item)
+        pipeline.srem(self._key(archive, "pending"), item)
+        pipeline.execute()
+
+    def is_seen(self, archive, link):
+        try:
+            return bool(
+                self.client.sismember(
+                    self._key(self._archive(archive), "seen"), pg_hashtext(link)
+                )
+            )
+        except Exception as e:
+            logger.warning(f"Failed to check the shared seen links: {e}")
+            return False
+
+    def add_seen(self, archive, links):
+        if not links:
+            return
+        key = self._key(self._archive(archive), "seen")
+        try:
+            pipeline = self.client.pipeline()
+            pipeline.sadd(key, *[pg_hashtext(link) for link in links])
+            pipeline.expire(key, self.SEEN_TTL)
+            pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Failed to update the shared seen links: {e}")
+
+    def wait_for_host(self, url):
+        """Book the next request slot of the url host and sleep until it."""
+        host = urlparse(url).netloc
+        try:
+            wait_ms = self.scripts["politeness"](
+                keys=[self._key("host", host)], args=[int(self.HOST_DELAY * 1000)]
+            )
+        except Exception as e:
+            logger.warning(f"Failed to book a request slot for {host}: {e}")
+            return
+        if wait_ms > 0:
+            time.sleep(wait_ms / 1000)
@@ -0,0 +1,159 @@
+import heapq
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from src.helpers.enum import DBCOLUMNS, CRAWLCOLUMNS, CrawlStatus, ResultModes
+from src.helpers.db_connector import DBConnector, DBManager
+
+
+logger = logging.getLogger(__name__)
+db_manager = DBManager()
+
+
+class GapScheduler:
+    """
+    Orders the pages of the collectors by expected yield instead of recency.
+
+    The expected number of articles of a day is the median daily density of the
+    archive over its months with articles. A page scores the articles it
+    should still add: expected articles over the days it covers, minus the
+    articles already stored for these days. Pages are skipped when several
+    other days visited in their month all returned no article, as the archive
+    likely has nothing for that period.
+    """
+
+    MIN_EMPTY_VISITS = 3
+
+    def __init__(self, collectors):
+        self.collectors = collectors
+
+    @staticmethod
+    def _get_frame(table, filters, group_by=None, columns=None):
+        if group_by is not None:
+            frame = DBConnector.group_by(
+                db_manager.engine,
+                table,
+                group_by,
+                filters=filters,
+                result_mode=ResultModes.frame,
+            )
+        else:
+            frame = DBConnector.get_all_rows(
+                db_manager.engine,
+                table,
+                filters=filters,
+                columns=columns,
+                result_mode=ResultModes.frame,
+            )
+        return frame if frame is not None and not frame.empty else None
+
+    def _get_daily_density(self, archive):
+        months = self._get_frame(
+            DBConnector.TABLE, {DBCOLUMNS.archive: [("eq", archive)]}, "month"
+        )
+        if months is None:
+            return 0.0
+        density = months["count"] / months["month"].dt.days_in_month
+        density = density[density > 0]
+        return float(density.median()) if not density.empty else 0.0
+
+    def _get_day_counts(self, archive, begin_date, end_date):
+        filters = {
+            DBCOLUMNS.archive: [("eq", archive)],
+            DBCOLUMNS.date: [("ge", begin_date), ("le", end_date)],
+        }
+        days = self._get_frame(DBConnector.TABLE, filters, "day")
+        if days is None:
+            return {}
+        return dict(zip(days["day"].dt.date, days["count"]))
+
+    def _get_empty_months(self, archive, begin_date, end_date, day_counts):
+        """
+        Months with several visited days, which all returned no article. The
+        empty listings count from their first visit, while they are partial.
+        """
+        filters = {
+            DBCOLUMNS.archive: [("eq", archive)],
+            DBCOLUMNS.date: [("ge", begin_date.replace(day=1)), ("le", end_date)],
+        }
+        states = self._get_frame(
+            DBConnector.CRAWL_STATE_TABLE,
+            filters,
+            columns=[
+                CRAWLCOLUMNS.date,
+                CRAWLCOLUMNS.status,
+                CRAWLCOLUMNS.sections,
+                CRAWLCOLUMNS.articles,
+            ],
+        )
+        if states is None:
+            return set()
+
+        months_with_articles = {(day.year, day.month) for day in day_counts}
+        empty_visits = Counter()
+        for date, status, sections, articles in states.itertuples(index=False):
+            month = (date.year, date.month)
+            if articles:
+                months_with_articles.add(month)
+            elif status == CrawlStatus.done or (
+                status == CrawlStatus.partial and sections == 0
+            ):
+                empty_visits[month] += 1
+        return {
+            month
+            for month, visits in empty_visits.items()
+            if visits >= self.MIN_EMPTY_VISITS and month not in months_with_articles
+        }
+
+    @staticmethod
+    def _get_span(collector, date, url):
+        """Days covered by the page of `date`, several for monthly archives."""
+        span = [date]
+        day = date + timedelta(days=1)
+        while day <= collector.end_date and collector.get_date_url(day) == url:
+            span.append(day)
+            day += timedelta(days=1)
+        return span
+
+    def get_priorities(self, collector):
+        pages = list(collector.get_all_urls())
+        if not pages:
+            return []
+
+        archive = collector.archive
+        begin_date = min(date for date, _ in pages)
+        density = self._get_daily_density(archive)
+        day_counts = self._get_day_counts(archive, begin_date, collector.end_date)
+        empty_months = self._get_empty_months(
+            archive, begin_date, collector.end_date, day_counts
+        )
+
+        priorities = []
+        skipped = 0
+        for date, url in pages:
+            if (date.year, date.month) in empty_months:
+                skipped += 1
+                continue
+            span = self._get_span(collector, date, url)
+            collected = sum(day_counts.get(day, 0) for day in span)
+            gap = max(density * len(span) - collected, 0)
+            priorities.append((gap, date, url))
+
+        logger.info(
+            f"{archive}: {len(priorities)} pages scheduled by coverage gap, "
+            f"{skipped} skipped"
+        )
+        return priorities
+
+    def schedule(self):
+        """Yield the (collector, date, url) pages, largest gap first."""
+        heap = []
+        for index, collector in enumerate(self.collectors):
+            for gap, date, url in self.get_priorities(collector):
+                heap.append((-gap, -date.toordinal(), index, date, url))
+        heapq.heapify(heap)
+
+        while heap:
+            _, _, index, date, url = heapq.heappop(heap)
+            yield self.collectors[index], date, url
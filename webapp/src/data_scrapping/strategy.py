@@ -3,6 +3,7 @@ import cloudscraper
 from abc import ABC, abstractmethod
 from src.helpers.enum import headers
 from src.utils.logging import logging
+from src.data_scrapping.frontier import CrawlFrontier
 
 
 logger = logging.getLogger(__name__)
@@ -41,6 +42,9 @@ class StrategyFactory:
     def __init__(self, collector):
         self._collector = collector
         self._request_strategy = RequestsFetchStrategy()
+        self._frontier = CrawlFrontier()
 
     def get_url_content(self, url):
+        if self._frontier.enabled:
+            self._frontier.wait_for_host(url)
         return self._request_strategy.get_url_content(url)
@@ -1,5 +1,7 @@
 import os
 import numpy as np
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import (
     create_engine,
     MetaData,
@@ -9,26 +11,131 @@ from sqlalchemy import (
     func,
     text,
     Index,
+    inspect,
     Computed,
     bindparam,
     BigInteger,
+    Boolean,
     true,
     tuple_,
     literal,
     literal_column,
+    update,
+    UniqueConstraint,
 )
 from sqlalchemy.sql import and_
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.pool import QueuePool
 from pgvector.sqlalchemy import Vector, HALFVEC
-from sqlalchemy.types import String, Date, Text
+from sqlalchemy.types import String, Date, Text, Integer, DateTime
 from sqlalchemy.dialects.postgresql import insert, REGCONFIG
 
 from src.utils.logging import logging
-from src.helpers.enum import DBCOLUMNS, OPERATORS
-from src.utils.utils import execute
+from src.helpers.enum import (
+    DBCOLUMNS,
+    CRAWLCOLUMNS,
+    DAILYCOLUMNS,
+    TAGCOLUMNS,
+    CrawlStatus,
+    OPERATORS,
+    ResultModes,
+    Archives,
+    PartitionLayouts,
+    HybridModes,
+    VectorPaths,
+)
+from src.helpers.pg_binary import BinaryCopy
+from src.utils.utils import (
+    execute,
+    run_query,
+    fetch_results,
+    TableCache,
+    reciprocal_rank_fusion,
+)
+from src.helpers.query_cache import QueryCache, cached
+
+# seconds the results of the read methods stay in the query cache
+KEYSET_CACHE_TTL = int(os.getenv("KEYSET_CACHE_TTL", 60))
+COUNT_CACHE_TTL = int(os.getenv("COUNT_CACHE_TTL", 300))
+GROUP_BY_CACHE_TTL = int(os.getenv("GROUP_BY_CACHE_TTL", 300))
+
+# rowid range tagged per transaction when the tag dictionary is first built
+TAG_BACKFILL_ROWS = int(os.getenv("TAG_BACKFILL_ROWS", 50000))
 
 logger = logging.getLogger(__name__)
 
+# statement level triggers keeping the daily counts of a table current,
+# with the changed rows in the `new_rows` and `old_rows` transition tables
+DAILY_DELTA = """
+    INSERT INTO {daily} AS daily (archive, date, has_image, tag, tag_id, count)
+    SELECT archive, date, has_image, tag, max(tag_id), sum(count)
+    FROM ({rows}) AS delta GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4
+    ON CONFLICT (archive, date, has_image, tag) DO UPDATE
+    SET count = daily.count + excluded.count,
+    tag_id = coalesce(excluded.tag_id, daily.tag_id);
+"""
+DAILY_ROWS = (
+    "SELECT {r}.archive, {r}.date, {r}.image IS NOT NULL AS has_image, "
+    "{r}.tag, {r}.tag_id, {sign} AS count"
+)
+DAILY_CHANGED = (
+    " FROM old_rows o JOIN new_rows n USING (rowid) "
+    "WHERE (o.archive, o.date, o.image IS NOT NULL, o.tag) "
+    "IS DISTINCT FROM (n.archive, n.date, n.image IS NOT NULL, n.tag)"
+)
+DAILY_TRIGGER = """
+    CREATE OR REPLACE FUNCTION {daily}_refresh() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            {inserted}
+        ELSIF TG_OP = 'DELETE' THEN
+            {deleted}
+        ELSE
+            {updated}
+        END IF;
+        RETURN NULL;
+    END;
+    $$;
+"""
+
+
+# the tag of a row is looked up, or added, in the tag dictionary
+TAG_LOOKUP = """
+    CREATE OR REPLACE FUNCTION {tags}_lookup() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        tag_name text := nullif(upper(trim(NEW.tag)), '');
+    BEGIN
+        NEW.tag_id := NULL;
+        IF tag_name IS NOT NULL THEN
+            SELECT tag_id INTO NEW.tag_id FROM {tags} WHERE name = tag_name;
+            IF NOT FOUND THEN
+                INSERT INTO {tags} (name, count) VALUES (tag_name, 0)
+                ON CONFLICT (name) DO NOTHING;
+                SELECT tag_id INTO NEW.tag_id FROM {tags} WHERE name = tag_name;
+            END IF;
+        END IF;
+        RETURN NEW;
+    END;
+    $$;
+"""
+# the tags are locked in order before being counted, like the daily counts
+TAG_DELTA = """
+    PERFORM 1 FROM {tags} WHERE tag_id IN (SELECT tag_id FROM {rows})
+    ORDER BY tag_id FOR UPDATE;
+    UPDATE {tags} AS tags SET count = tags.count + delta.count
+    FROM (SELECT tag_id, sum(sign) AS count FROM {rows} GROUP BY tag_id) AS delta
+    WHERE tags.tag_id = delta.tag_id;
+"""
+TAG_ROWS = "(SELECT tag_id, {sign} AS sign FROM {r} WHERE tag_id IS NOT NULL)"
+TAG_CHANGED = (
+    "(SELECT o.tag_id, -1 AS sign FROM old_rows o JOIN new_rows n USING (rowid) "
+    "WHERE o.tag_id IS DISTINCT FROM n.tag_id AND o.tag_id IS NOT NULL "
+    "UNION ALL SELECT n.tag_id, 1 FROM old_rows o JOIN new_rows n USING (rowid) "
+    "WHERE o.tag_id IS DISTINCT FROM n.tag_id AND n.tag_id IS NOT NULL)"
+)
+
 
 class DBManager:
     _engine = None
@@ -71,7 +178,13 @@ class DBManager:
 
 class DBConnector:
     TABLE = "articles"
+    CRAWL_STATE_TABLE = "crawl_state"
     VECTOR_DIM = 1024
+    EXACT_COUNT_LIMIT = int(os.getenv("EXACT_COUNT_LIMIT", 100_000))
+    PARTITIONS = PartitionLayouts(os.getenv("ARTICLES_PARTITIONS", "none"))
+    # per (engine url, table): partition layout, and the years with a partition
+    _layouts = {}
+    _years = {}
 
     @staticmethod
     def drop_table(engine, table):
@@ -79,11 +192,46 @@ class DBConnector:
         table_ref = Table(table, metadata, autoload_with=engine)
 
         table_ref.drop(engine)
+        TableCache.invalidate(engine, table)
+        DBConnector.invalidate_partitions(engine, table)
+        QueryCache().bump(table)
+
+        daily = DBConnector.get_daily_table(table)
+        tags = DBConnector.get_tags_table(table)
+        for derived in [daily, tags]:
+            if DBConnector.has_table(engine, derived):
+                DBConnector.drop_table(engine, derived)
+
+        # the trigger functions outlive the triggers dropped with the table
+        with engine.begin() as connection:
+            for function in [f"{daily}_refresh", f"{tags}_refresh", f"{tags}_lookup"]:
+                connection.execute(text(f"DROP FUNCTION IF EXISTS {function}()"))
 
     @staticmethod
-    def create_table(engine, table):
+    def create_table(engine, table, partitions=None):
+        """
+        Create the articles table, range partitioned by year of `date` and
+        optionally by archive within each year when `partitions` (by default
+        `ARTICLES_PARTITIONS`) is not none. The primary key and the unique
+        link hash then include the partition keys, and the partitions are
+        created on demand by `add_partitions`.
+        """
         metadata = MetaData()
         has_table = DBConnector.has_table(engine, table)
+        partitions = PartitionLayouts(partitions or DBConnector.PARTITIONS)
+        keys = {
+            PartitionLayouts.none: [],
+            PartitionLayouts.year: [DBCOLUMNS.date.value],
+            PartitionLayouts.year_archive: [
+                DBCOLUMNS.date.value,
+                DBCOLUMNS.archive.value,
+            ],
+        }[partitions]
+        options = (
+            {"postgresql_partition_by": f"RANGE ({DBCOLUMNS.date.value})"}
+            if keys
+            else {}
+        )
 
         if not has_table:
             logger.info(f"creating table {table}")
@@ -96,12 +244,23 @@ class DBConnector:
                     primary_key=True,
                     autoincrement=True,
                 ),
-                Column(DBCOLUMNS.date.value, Date, nullable=False),
-                Column(DBCOLUMNS.archive.value, String, nullable=False),
+                Column(
+                    DBCOLUMNS.date.value,
+                    Date,
+                    nullable=False,
+                    primary_key=DBCOLUMNS.date.value in keys,
+                ),
+                Column(
+                    DBCOLUMNS.archive.value,
+                    String,
+                    nullable=False,
+                    primary_key=DBCOLUMNS.archive.value in keys,
+                ),
                 Column(DBCOLUMNS.image.value, Text, nullable=True),
                 Column(DBCOLUMNS.title.value, String, nullable=True),
                 Column(DBCOLUMNS.content.value, String, nullable=True),
                 Column(DBCOLUMNS.tag.value, String, nullable=True),
+                Column(DBCOLUMNS.tag_id.value, Integer, nullable=True),
                 Column(DBCOLUMNS.link.value, String, nullable=False),
                 Column(
                     DBCOLUMNS.hash.value,
@@ -110,34 +269,562 @@ class DBConnector:
                         f"hashtext({DBCOLUMNS.link.value})::BIGINT", persisted=True
                     ),
                     nullable=False,
-                    unique=True,
                 ),
                 Column(
                     DBCOLUMNS.embedding.value,
                     HALFVEC(DBConnector.VECTOR_DIM),
                     nullable=True,
                 ),
+                UniqueConstraint(DBCOLUMNS.hash.value, *keys),
                 Index(
-                    f"{DBConnector.TABLE}_date_rowid_index",
+                    f"{table}_date_rowid_index",
                     Column(DBCOLUMNS.date.value),
                     Column(DBCOLUMNS.rowid.value),
                 ),
+                **options,
             )
 
             metadata.create_all(engine)
 
-            DBConnector.add_searchable_column(engine, table, DBCOLUMNS.text_searchable)
+            DBConnector.add_searchable_column(
+                engine, table, DBCOLUMNS.text_searchable.value
+            )
             DBConnector.add_vector_index(engine, table, DBCOLUMNS.embedding.value)
+            TableCache.invalidate(engine, table)
+            DBConnector.invalidate_partitions(engine, table)
+            DBConnector._layouts[(str(engine.url), table)] = partitions
 
             return table_ref
 
-        return Table(DBConnector.TABLE, metadata, autoload_with=engine)
+        DBConnector.add_tag_column(engine, table)
+        return TableCache.get(engine, table)
 
     @staticmethod
-    def has_table(engine, table):
+    def add_tag_column(engine, table):
+        """Add the `tag_id` column to the tables created before the tag dictionary."""
+        # the ALTER takes an ACCESS EXCLUSIVE lock even when the column exists
+        if DBCOLUMNS.tag_id.value in TableCache.get(engine, table).c:
+            return
+
+        with engine.connect() as connection:
+            connection.execute(
+                text(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS tag_id INTEGER")
+            )
+            connection.commit()
+        TableCache.invalidate(engine, table)
+
+    @staticmethod
+    def get_filter_indexes(table):
+        """Indexes matching the filters of the interface, by name."""
+        return {
+            # archive selection with a date range, in keyset order
+            f"{table}_archive_date_rowid_index": f"ON {table} (archive, date, rowid)",
+            # tag selected in the interface, in keyset order
+            f"{table}_tag_id_date_rowid_index": f"ON {table} (tag_id, date, rowid)",
+            # articles with an image, in keyset order
+            f"{table}_image_date_rowid_index": (
+                f"ON {table} (date, rowid) WHERE image IS NOT NULL"
+            ),
+        }
+
+    @staticmethod
+    def add_filter_indexes(engine, table):
+        """
+        Create the missing filter indexes, and rebuild those left invalid by an
+        interrupted build. Plain tables are indexed concurrently so that the
+        collectors can keep inserting, which partitioned tables don't support.
+        A concurrent build is invalid until it ends: the indexes still being
+        built by another session are left alone.
+        """
+        indexes = DBConnector.get_filter_indexes(table)
+        with engine.connect() as connection:
+            valid = dict(
+                connection.execute(
+                    text(
+                        "SELECT c.relname, i.indisvalid OR EXISTS ("
+                        "SELECT 1 FROM pg_stat_progress_create_index p "
+                        "WHERE p.index_relid = i.indexrelid) FROM pg_index i "
+                        "JOIN pg_class c ON c.oid = i.indexrelid "
+                        "WHERE c.relname = ANY(:names)"
+                    ),
+                    {"names": list(indexes)},
+                ).fetchall()
+            )
+        missing = [name for name in indexes if not valid.get(name)]
+        if not missing:
+            return
+
+        partitioned = (
+            DBConnector.get_partition_layout(engine, table) != PartitionLayouts.none
+        )
+        concurrently = "" if partitioned else "CONCURRENTLY "
+        with engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as connection:
+            for name in missing:
+                if name in valid:
+                    connection.execute(
+                        text(f"DROP INDEX {concurrently}IF EXISTS {name}")
+                    )
+                logger.info(f"creating index {name}")
+                connection.execute(
+                    text(
+                        f"CREATE INDEX {concurrently}IF NOT EXISTS {name} "
+                        f"{indexes[name]}"
+                    )
+                )
+
+    @staticmethod
+    def get_partition_layout(engine, table):
+        key = (str(engine.url), table)
+        layout = DBConnector._layouts.get(key)
+        if layout is None:
+            with engine.connect() as connection:
+                partitioned, children, sub_partitioned = connection.execute(
+                    text(
+                        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                        "WHERE partrelid = to_regclass(:table)), count(i.inhrelid), "
+                        "count(p.partrelid) FROM pg_inherits i "
+                        "LEFT JOIN pg_partitioned_table p ON p.partrelid = i.inhrelid "
+                        "WHERE i.inhparent = to_regclass(:table)"
+                    ),
+                    {"table": table},
+                ).one()
+            if not partitioned:
+                layout = PartitionLayouts.none
+            elif sub_partitioned:
+                layout = PartitionLayouts.year_archive
+            elif children or DBConnector.PARTITIONS == PartitionLayouts.none:
+                layout = PartitionLayouts.year
+            else:
+                layout = DBConnector.PARTITIONS
+            DBConnector._layouts[key] = layout
+        return layout
+
+    @staticmethod
+    def get_partition_statements(table, year, layout):
+        """DDL of the partition of `year`, with a partition per archive inside."""
+        partition = f"{table}_{year}"
+        statements = [
+            f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{year:04d}-01-01') TO ('{year + 1:04d}-01-01')"
+        ]
+        if layout == PartitionLayouts.year_archive:
+            statements[0] += f" PARTITION BY LIST ({DBCOLUMNS.archive.value})"
+            statements += [
+                f"CREATE TABLE IF NOT EXISTS {partition}_{archive.value} "
+                f"PARTITION OF {partition} FOR VALUES IN ('{archive.value}')"
+                for archive in Archives
+            ]
+            statements.append(
+                f"CREATE TABLE IF NOT EXISTS {partition}_default "
+                f"PARTITION OF {partition} DEFAULT"
+            )
+        return statements
+
+    @staticmethod
+    def add_partitions(engine, table, years):
+        """Create the partitions of `years` missing from a partitioned table."""
+        layout = DBConnector.get_partition_layout(engine, table)
+        if layout == PartitionLayouts.none:
+            return
+
+        created = DBConnector._years.setdefault((str(engine.url), table), set())
+        for year in sorted(set(years) - created):
+            try:
+                with engine.begin() as connection:
+                    for statement in DBConnector.get_partition_statements(
+                        table, year, layout
+                    ):
+                        connection.execute(text(statement))
+            except DBAPIError as e:
+                # another worker may have created it at the same time
+                logger.warning(f"Failed to create the {year} partition of {table}: {e}")
+                continue
+            created.add(year)
+
+    @staticmethod
+    def invalidate_partitions(engine, table):
+        DBConnector._layouts.pop((str(engine.url), table), None)
+        DBConnector._years.pop((str(engine.url), table), None)
+
+    @staticmethod
+    def get_daily_table(table):
+        return f"{table}_daily"
+
+    @staticmethod
+    def create_daily_table(engine, table):
+        """
+        Article counts per (archive, date, has_image, tag) of `table`, kept
+        current by triggers on its inserts, updates and deletes. The existing
+        rows are counted while the table is locked, so no write is missed.
+        """
+        daily = DBConnector.get_daily_table(table)
+        if DBConnector.has_table(engine, daily):
+            return TableCache.get(engine, daily)
+
         metadata = MetaData()
-        metadata.reflect(bind=engine)
-        return table in metadata.tables
+        table_ref = Table(
+            daily,
+            metadata,
+            Column(DAILYCOLUMNS.archive.value, String, nullable=False),
+            Column(DAILYCOLUMNS.date.value, Date, nullable=False),
+            Column(DAILYCOLUMNS.has_image.value, Boolean, nullable=False),
+            Column(DAILYCOLUMNS.tag.value, String, nullable=True),
+            Column(DAILYCOLUMNS.tag_id.value, Integer, nullable=True),
+            Column(DAILYCOLUMNS.count.value, Integer, nullable=False),
+            Index(
+                f"{daily}_key_index",
+                DAILYCOLUMNS.archive.value,
+                DAILYCOLUMNS.date.value,
+                DAILYCOLUMNS.has_image.value,
+                DAILYCOLUMNS.tag.value,
+                unique=True,
+                postgresql_nulls_not_distinct=True,
+            ),
+        )
+
+        with engine.connect() as connection:
+            DBConnector.lock_creation(connection, daily)
+            if DBConnector.has_table(connection, daily):
+                connection.commit()
+                return TableCache.get(engine, daily)
+
+            logger.info(f"creating table {daily}")
+            connection.execute(text(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE"))
+            metadata.create_all(connection)
+            DBConnector.add_daily_triggers(connection, table)
+            connection.execute(
+                text(
+                    f"INSERT INTO {daily} (archive, date, has_image, tag, tag_id, count) "
+                    f"SELECT archive, date, image IS NOT NULL, tag, max(tag_id), "
+                    f"count(*) FROM {table} GROUP BY 1, 2, 3, 4"
+                )
+            )
+            connection.commit()
+
+        TableCache.invalidate(engine, daily)
+        return table_ref
+
+    @staticmethod
+    def add_daily_triggers(connection, table):
+        daily = DBConnector.get_daily_table(table)
+        DBConnector.add_daily_function(connection, table)
+        transitions = {
+            "INSERT": "NEW TABLE AS new_rows",
+            "DELETE": "OLD TABLE AS old_rows",
+            "UPDATE": "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+        }
+        for event, transition in transitions.items():
+            connection.execute(
+                text(
+                    f"CREATE TRIGGER {daily}_{event.lower()} "
+                    f"AFTER {event} ON {table} "
+                    f"REFERENCING {transition} FOR EACH STATEMENT "
+                    f"EXECUTE FUNCTION {daily}_refresh()"
+                )
+            )
+
+    @staticmethod
+    def add_daily_function(connection, table):
+        daily = DBConnector.get_daily_table(table)
+        changed_rows = (
+            DAILY_ROWS.format(r="o", sign=-1)
+            + DAILY_CHANGED
+            + " UNION ALL "
+            + DAILY_ROWS.format(r="n", sign=1)
+            + DAILY_CHANGED
+        )
+        function = DAILY_TRIGGER.format(
+            daily=daily,
+            inserted=DAILY_DELTA.format(
+                daily=daily,
+                rows=DAILY_ROWS.format(r="new_rows", sign=1) + " FROM new_rows",
+            ),
+            deleted=DAILY_DELTA.format(
+                daily=daily,
+                rows=DAILY_ROWS.format(r="old_rows", sign=-1) + " FROM old_rows",
+            ),
+            updated=DAILY_DELTA.format(daily=daily, rows=changed_rows),
+        )
+        connection.execute(text(function))
+
+    @staticmethod
+    def drop_daily_triggers(connection, table):
+        daily = DBConnector.get_daily_table(table)
+        for event in ["insert", "delete", "update"]:
+            connection.execute(
+                text(f"DROP TRIGGER IF EXISTS {daily}_{event} ON {table}")
+            )
+
+    @staticmethod
+    def get_tags_table(table):
+        return f"{table}_tags"
+
+    @staticmethod
+    def create_tags_table(engine, table):
+        """
+        Dictionary of the normalized tags of `table`, with the number of rows
+        of each. A trigger sets the `tag_id` of the inserted and retagged rows,
+        adding the new tags, and statement triggers keep the counts current.
+        The existing rows are then tagged by `backfill_tags`.
+        """
+        tags = DBConnector.get_tags_table(table)
+        daily = DBConnector.get_daily_table(table)
+        # the tag_id filter index is built after the backfill, an interrupted
+        # backfill is resumed until then
+        if DBConnector.has_table(engine, tags) and DBConnector.has_relation(
+            engine, f"{table}_tag_id_date_rowid_index"
+        ):
+            return TableCache.get(engine, tags)
+
+        DBConnector.add_tag_column(engine, table)
+        metadata = MetaData()
+        Table(
+            tags,
+            metadata,
+            Column(TAGCOLUMNS.tag_id.value, Integer, primary_key=True),
+            Column(TAGCOLUMNS.name.value, String, nullable=False),
+            Column(TAGCOLUMNS.count.value, BigInteger, nullable=False),
+            # unique, and serves the prefix searches
+            Index(
+                f"{tags}_name_index",
+                TAGCOLUMNS.name.value,
+                unique=True,
+                postgresql_ops={TAGCOLUMNS.name.value: "text_pattern_ops"},
+            ),
+        )
+
+        with engine.connect() as connection:
+            DBConnector.lock_creation(connection, tags)
+            if not DBConnector.has_table(connection, tags):
+                logger.info(f"creating table {tags}")
+                metadata.create_all(connection)
+                if DBConnector.has_table(connection, daily):
+                    connection.execute(
+                        text(
+                            f"ALTER TABLE {daily} ADD COLUMN IF NOT EXISTS tag_id INTEGER"
+                        )
+                    )
+                    DBConnector.add_daily_function(connection, table)
+                DBConnector.add_tag_triggers(connection, table)
+            connection.commit()
+
+        TableCache.invalidate(engine, tags)
+        TableCache.invalidate(engine, daily)
+        DBConnector.backfill_tags(engine, table)
+        return TableCache.get(engine, tags)
+
+    @staticmethod
+    def backfill_tags(engine, table):
+        """
+        Set the `tag_id` of the rows written before the tag dictionary, a
+        rowid range per transaction so the collectors are never blocked. The
+        count triggers are installed first, they count the tagged rows.
+        """
+        tags = DBConnector.get_tags_table(table)
+        daily = DBConnector.get_daily_table(table)
+        name = "nullif(upper(trim(tag)), '')"
+        with engine.connect() as connection:
+            begin, end = connection.execute(
+                text(f"SELECT min(rowid), max(rowid) FROM {table}")
+            ).one()
+
+        tagged = 0
+        for start in range(begin or 0, (end or -1) + 1, TAG_BACKFILL_ROWS):
+            bounds = {"start": start, "stop": start + TAG_BACKFILL_ROWS}
+            with engine.begin() as connection:
+                connection.execute(
+                    text(
+                        f"INSERT INTO {tags} (name, count) "
+                        f"SELECT DISTINCT {name}, 0 FROM {table} "
+                        "WHERE rowid >= :start AND rowid < :stop AND tag_id IS NULL "
+                        f"AND {name} IS NOT NULL "
+                        "ORDER BY 1 ON CONFLICT (name) DO NOTHING"
+                    ),
+                    bounds,
+                )
+                tagged += connection.execute(
+                    text(
+                        f"UPDATE {table} SET tag_id = tags.tag_id FROM {tags} AS tags "
+                        f"WHERE {table}.rowid >= :start AND {table}.rowid < :stop "
+                        f"AND {table}.tag_id IS NULL "
+                        f"AND tags.name = upper(trim({table}.tag))"
+                    ),
+                    bounds,
+                ).rowcount
+            logger.info(
+                f"{tags}: {tagged} rows were tagged, up to rowid {bounds['stop']}"
+            )
+
+        if DBConnector.has_table(engine, daily):
+            with engine.begin() as connection:
+                connection.execute(
+                    text(
+                        f"UPDATE {daily} SET tag_id = tags.tag_id FROM {tags} AS tags "
+                        f"WHERE {daily}.tag_id IS NULL "
+                        f"AND tags.name = upper(trim({daily}.tag))"
+                    )
+                )
+
+    @staticmethod
+    def add_tag_triggers(connection, table):
+        tags = DBConnector.get_tags_table(table)
+        connection.execute(text(TAG_LOOKUP.format(tags=tags)))
+        connection.execute(
+            text(
+                f"CREATE TRIGGER {tags}_lookup "
+                f"BEFORE INSERT OR UPDATE OF tag ON {table} "
+                f"FOR EACH ROW EXECUTE FUNCTION {tags}_lookup()"
+            )
+        )
+
+        changed = {
+            "INSERT": TAG_ROWS.format(r="new_rows", sign=1),
+            "DELETE": TAG_ROWS.format(r="old_rows", sign=-1),
+            "UPDATE": TAG_CHANGED,
+        }
+        function = DAILY_TRIGGER.replace("{daily}_refresh", "{tags}_refresh").format(
+            tags=tags,
+            inserted=TAG_DELTA.format(tags=tags, rows=changed["INSERT"]),
+            deleted=TAG_DELTA.format(tags=tags, rows=changed["DELETE"]),
+            updated=TAG_DELTA.format(tags=tags, rows=changed["UPDATE"]),
+        )
+        connection.execute(text(function))
+        transitions = {
+            "INSERT": "NEW TABLE AS new_rows",
+            "DELETE": "OLD TABLE AS old_rows",
+            "UPDATE": "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+        }
+        for event, transition in transitions.items():
+            connection.execute(
+                text(
+                    f"CREATE TRIGGER {tags}_{event.lower()} "
+                    f"AFTER {event} ON {table} "
+                    f"REFERENCING {transition} FOR EACH STATEMENT "
+                    f"EXECUTE FUNCTION {tags}_refresh()"
+                )
+            )
+
+    @staticmethod
+    def drop_tag_triggers(connection, table):
+        tags = DBConnector.get_tags_table(table)
+        for event in ["lookup", "insert", "delete", "update"]:
+            connection.execute(
+                text(f"DROP TRIGGER IF EXISTS {tags}_{event} ON {table}")
+            )
+
+    @execute
+    @staticmethod
+    def search_tags(table_ref, prefix=None, tag_ids=None, limit=100):
+        """Most frequent tags starting with `prefix`, as (tag_id, name) rows."""
+        query = select(
+            table_ref.c[TAGCOLUMNS.tag_id], table_ref.c[TAGCOLUMNS.name]
+        ).where(table_ref.c[TAGCOLUMNS.count] > 0)
+        if prefix:
+            query = query.where(
+                table_ref.c[TAGCOLUMNS.name].startswith(
+                    prefix.strip().upper(), autoescape=True
+                )
+            )
+        if tag_ids:
+            query = query.where(table_ref.c[TAGCOLUMNS.tag_id].in_(tag_ids))
+        return query.order_by(table_ref.c[TAGCOLUMNS.count].desc()).limit(limit)
+
+    @staticmethod
+    def get_daily_filters(engine, table, filters=None):
+        """
+        Translate the filters to the daily counts table, or return None when
+        they can't be answered from it: text or vector search, filters on
+        other columns, or no daily table yet.
+        """
+        daily_filters = {}
+        for column, ops in (filters or {}).items():
+            if column in [
+                DBCOLUMNS.archive,
+                DBCOLUMNS.date,
+                DBCOLUMNS.tag,
+                DBCOLUMNS.tag_id,
+            ]:
+                daily_filters[column] = ops
+            elif column == DBCOLUMNS.image and all(
+                op in [OPERATORS.notnull, OPERATORS.isnull] for op, _ in ops
+            ):
+                daily_filters[DAILYCOLUMNS.has_image] = [
+                    (OPERATORS.eq, op == OPERATORS.notnull) for op, _ in ops
+                ]
+            else:
+                return None
+
+        daily = DBConnector.get_daily_table(table)
+        if TableCache.get(engine, daily) is None:
+            return None
+        return daily_filters
+
+    @staticmethod
+    def create_crawl_state_table(engine, table):
+        """One row per (archive, date) listing page visited by a collector."""
+        metadata = MetaData()
+        if DBConnector.has_table(engine, table):
+            # added after the first crawl state tables
+            if CRAWLCOLUMNS.empty_visits.value not in TableCache.get(engine, table).c:
+                with engine.begin() as connection:
+                    connection.execute(
+                        text(
+                            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS "
+                            "empty_visits INTEGER NOT NULL DEFAULT 0"
+                        )
+                    )
+                TableCache.invalidate(engine, table)
+            return TableCache.get(engine, table)
+
+        logger.info(f"creating table {table}")
+        table_ref = Table(
+            table,
+            metadata,
+            Column(CRAWLCOLUMNS.archive.value, String, primary_key=True),
+            Column(CRAWLCOLUMNS.date.value, Date, primary_key=True),
+            Column(CRAWLCOLUMNS.status.value, String, nullable=False),
+            Column(CRAWLCOLUMNS.sections.value, Integer, nullable=True),
+            Column(CRAWLCOLUMNS.articles.value, Integer, nullable=True),
+            # consecutive visits of the listing that found no section
+            Column(
+                CRAWLCOLUMNS.empty_visits.value,
+                Integer,
+                nullable=False,
+                server_default="0",
+            ),
+            Column(CRAWLCOLUMNS.error.value, Text, nullable=True),
+            Column(CRAWLCOLUMNS.started_at.value, DateTime, nullable=True),
+            Column(CRAWLCOLUMNS.finished_at.value, DateTime, nullable=True),
+        )
+        metadata.create_all(engine)
+        TableCache.invalidate(engine, table)
+        return table_ref
+
+    @staticmethod
+    def has_table(engine, table):
+        return inspect(engine).has_table(table)
+
+    @staticmethod
+    def has_relation(engine, name):
+        with engine.connect() as connection:
+            return (
+                connection.execute(
+                    text("SELECT to_regclass(:name)"), {"name": name}
+                ).scalar()
+                is not None
+            )
+
+    @staticmethod
+    def lock_creation(connection, table):
+        """
+        Serialize the sessions creating `table` until the transaction ends.
+        A transaction lock, the session ones don't survive pgbouncer.
+        """
+        connection.execute(
+            text("SELECT pg_advisory_xact_lock(hashtext(:table))"), {"table": table}
+        )
 
     @staticmethod
     def add_searchable_column(engine, table, column_name):
@@ -167,7 +854,7 @@ class DBConnector:
             )
             connection.execute(
                 text(
-                    f"CREATE INDEX {DBConnector.TABLE}_{column_name}_index ON {table} "
+                    f"CREATE INDEX {table}_{column_name}_index ON {table} "
                     f"USING GIN ({column_name})"
                 )
             )
@@ -178,7 +865,7 @@ class DBConnector:
         with engine.connect() as connection:
             connection.execute(
                 text(
-                    f"CREATE INDEX {DBConnector.TABLE}_{column_name}_index ON {table} "
+                    f"CREATE INDEX {table}_{column_name}_index ON {table} "
                     f"USING hnsw ({column_name} halfvec_ip_ops) "
                     "WITH (m = 32, ef_construction = 128) "
                     f"WHERE {column_name} IS NOT NULL;"
@@ -190,6 +877,7 @@ class DBConnector:
     def apply_filters(query, table_ref, filters):
         return DynamicFilters.apply(query, table_ref, filters)
 
+    @cached(ttl=COUNT_CACHE_TTL)
     @execute
     @staticmethod
     def get_total_count(table_ref, filters=None):
@@ -198,9 +886,307 @@ class DBConnector:
 
         return query
 
+    @staticmethod
+    def estimate_count(engine, table, filters=None):
+        """Number of rows the planner expects the filtered query to return."""
+        table_ref = TableCache.get(engine, table)
+        if table_ref is None:
+            return None
+
+        query = select(table_ref.c[DBCOLUMNS.rowid])
+        query = DBConnector.apply_filters(query, table_ref, filters)
+        compiled = query.compile(engine, compile_kwargs={"render_postcompile": True})
+        with engine.connect() as connection:
+            plan = connection.exec_driver_sql(
+                f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params
+            ).scalar()
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    @cached(ttl=KEYSET_CACHE_TTL)
+    @execute
+    @staticmethod
+    def get_text_candidates(table_ref, ts_ops, filters=None):
+        return DynamicFilters.get_text_leg(table_ref, ts_ops, filters)
+
+    @cached(ttl=KEYSET_CACHE_TTL)
+    @execute
+    @staticmethod
+    def get_vector_candidates(table_ref, vec_ops, filters=None, path=VectorPaths.hnsw):
+        return DynamicFilters.get_vector_leg(table_ref, vec_ops, filters, path)
+
+    @staticmethod
+    def get_prefilter_candidates(engine, table, vec_ops, filters=None):
+        """
+        The `prefilter` path. None when more than `PREFILTER_ROWS` rows match,
+        the planner estimate was too low and the distances would only rank an
+        arbitrary part of them.
+        """
+        rows = DBConnector.get_vector_candidates(
+            engine, table, vec_ops, filters, VectorPaths.prefilter
+        )
+        if not rows or rows[0][0] > DynamicFilters.PREFILTER_ROWS:
+            return None
+        return [[rowid, rank] for _, rowid, rank in rows if rowid is not None]
+
+    @cached(ttl=KEYSET_CACHE_TTL, with_mode=False)
+    @staticmethod
+    def rescan_vector_candidates(engine, table, vec_ops, filters=None):
+        """
+        The `hnsw` path again, with the iterative scan allowed to visit up to
+        `HNSW_MAX_SCAN_TUPLES` tuples, for the filters matching too many rows
+        to compute all their distances.
+        """
+        table_ref = TableCache.get(engine, table)
+        if table_ref is None:
+            return None
+
+        with engine.connect() as connection:
+            with connection.begin():
+                connection.execute(
+                    text("SELECT set_config('hnsw.max_scan_tuples', :tuples, true)"),
+                    {"tuples": str(DynamicFilters.HNSW_MAX_SCAN_TUPLES)},
+                )
+                result = run_query(
+                    connection,
+                    engine,
+                    table,
+                    table_ref,
+                    DynamicFilters.get_vector_leg,
+                    (vec_ops, filters),
+                    {},
+                )
+                return fetch_results(result, ResultModes.rows)
+
+    @staticmethod
+    def plan_vector_search(engine, table, filters=None):
+        """
+        The path of a filtered vector search and the planner estimate of the
+        filtered rows: `exact` when they are few enough to be ranked in the
+        process, `prefilter` when postgres can compute all their distances,
+        else `hnsw` with the filters checked during the scan.
+        """
+        if not filters:
+            return VectorPaths.hnsw, None
+        estimate = DBConnector.estimate_count(engine, table, filters)
+        if estimate is None:
+            return VectorPaths.hnsw, estimate
+        if estimate <= DynamicFilters.EXACT_SEARCH_ROWS:
+            return VectorPaths.exact, estimate
+        if estimate <= DynamicFilters.PREFILTER_ROWS:
+            return VectorPaths.prefilter, estimate
+        return VectorPaths.hnsw, estimate
+
+    @cached(ttl=KEYSET_CACHE_TTL, with_mode=False)
+    @staticmethod
+    def get_exact_candidates(engine, table, vec_ops, filters=None):
+        """
+        Rank every filtered row by its exact distance, in batches in numpy.
+        None when more than `EXACT_SEARCH_ROWS` rows match, the planner
+        estimate was too low.
+        """
+        limit = DynamicFilters.EXACT_SEARCH_ROWS
+        embeddings = DBConnector.export_embeddings(engine, table, filters, limit + 1)
+        if embeddings is None:
+            return None
+        rowids, embeddings = embeddings
+        if len(rowids) > limit:
+            return None
+        return DynamicFilters.rank_exact(rowids, embeddings, vec_ops)
+
+    @staticmethod
+    def search_vectors(engine, table, vec_ops, filters=None):
+        """
+        Ranked rowids of the nearest rows matching the filters, and the path
+        that found them. When the HNSW scan gives up before finding `TOP_K`
+        rows while the planner expects more matches, it is run again with a
+        larger scan budget. When more rows match than the `exact` path ranks,
+        the search is run over the filtered rows, and when more match than the
+        `prefilter` path reads, with the HNSW index.
+        """
+        path, estimate = DBConnector.plan_vector_search(engine, table, filters)
+        if path == VectorPaths.exact:
+            ranking = DBConnector.get_exact_candidates(engine, table, vec_ops, filters)
+            if ranking is None:
+                logger.info(
+                    f"more than {DynamicFilters.EXACT_SEARCH_ROWS} rows match, "
+                    "searching the filtered rows in postgres"
+                )
+                path = VectorPaths.prefilter
+        if path == VectorPaths.prefilter:
+            ranking = DBConnector.get_prefilter_candidates(
+                engine, table, vec_ops, filters
+            )
+            if ranking is None:
+                logger.info(
+                    f"more than {DynamicFilters.PREFILTER_ROWS} rows match, "
+                    "searching them with the hnsw index"
+                )
+                path = VectorPaths.hnsw
+                estimate = max(estimate, DynamicFilters.PREFILTER_ROWS + 1)
+        if path == VectorPaths.hnsw:
+            ranking = DBConnector.get_vector_candidates(
+                engine, table, vec_ops, filters, path
+            )
+
+        expected = min(int(DynamicFilters.TOP_K), estimate or 0)
+        if path == VectorPaths.hnsw and ranking is not None and len(ranking) < expected:
+            logger.info(
+                f"the hnsw scan found {len(ranking)} of {expected} rows, "
+                f"scanning up to {DynamicFilters.HNSW_MAX_SCAN_TUPLES} tuples"
+            )
+            ranking = DBConnector.rescan_vector_candidates(
+                engine, table, vec_ops, filters
+            )
+
+        expected = "unfiltered" if estimate is None else f"{estimate} rows expected"
+        logger.info(
+            f"vector search: {path.value} path ({expected}), "
+            f"{len(ranking) if ranking is not None else 0} found"
+        )
+        return ranking, path
+
+    @staticmethod
+    def get_hybrid_filters(
+        engine, table, filters, vector_weight=None, bm25_weight=None, mode=None
+    ):
+        """
+        With the `parallel` mode, run the text and vector legs of a search
+        concurrently on two pooled connections, each with the other filters
+        applied, and fuse their rankings client side. The search filters are
+        replaced by the `TOP_K` fused rowids, so that only those rows are read
+        by the page, count and histogram queries. The `sql` mode leaves the
+        fusion to `DynamicFilters`. The path of the vector search is returned
+        with the filters, None without one. In both modes, the weights given
+        are carried by the search filters.
+        """
+        mode = HybridModes(mode or DynamicFilters.HYBRID_MODE)
+        ts_key, sim_key = DBCOLUMNS.text_searchable, DBCOLUMNS.embedding
+        path = VectorPaths.hnsw if filters and sim_key in filters else None
+        for key, weight in [(ts_key, bm25_weight), (sim_key, vector_weight)]:
+            if filters and key in filters and weight is not None:
+                filters = {**filters, key: [*filters[key], (OPERATORS.weight, weight)]}
+        if (
+            not filters
+            or mode != HybridModes.parallel
+            or (ts_key not in filters and sim_key not in filters)
+        ):
+            return filters, path
+
+        others = {
+            column: ops
+            for column, ops in filters.items()
+            if column not in [ts_key, sim_key]
+        }
+        legs, weights, vector_leg = [], [], None
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            if ts_key in filters:
+                legs.append(
+                    executor.submit(
+                        DBConnector.get_text_candidates,
+                        engine,
+                        table,
+                        filters[ts_key],
+                        others,
+                    )
+                )
+                weights.append(
+                    DynamicFilters.get_weight(
+                        filters[ts_key], DynamicFilters.BM25_WEIGHT
+                    )
+                )
+            if sim_key in filters:
+                vector_leg = executor.submit(
+                    DBConnector.search_vectors, engine, table, filters[sim_key], others
+                )
+                legs.append(vector_leg)
+                weights.append(
+                    DynamicFilters.get_weight(
+                        filters[sim_key], DynamicFilters.VECTOR_WEIGHT
+                    )
+                )
+            rankings = [leg.result() for leg in legs]
+        if vector_leg is not None:
+            rankings[-1], path = rankings[-1]
+        if any(ranking is None for ranking in rankings):
+            return filters, path
+
+        rowids, _ = reciprocal_rank_fusion(
+            [[rowid for rowid, _ in ranking] for ranking in rankings],
+            weights,
+            int(DynamicFilters.TOP_K),
+            DynamicFilters.RRF_K,
+        )
+        others[DBCOLUMNS.rowid] = [(OPERATORS.in_, rowids)]
+        return others, path
+
+    @staticmethod
+    def get_fast_count(engine, table, filters=None):
+        """
+        Return the count and whether it is approximate. The count is summed
+        from the daily counts when the filters allow it, otherwise large
+        results are estimated by the planner instead of counted. Text and vector searches
+        return at most `DynamicFilters.TOP_K` rows, so they are always counted.
+        """
+        filters = filters or {}
+        daily_filters = DBConnector.get_daily_filters(engine, table, filters)
+        if daily_filters is not None:
+            count = DBConnector.get_daily_count(
+                engine,
+                DBConnector.get_daily_table(table),
+                daily_filters,
+                result_mode=ResultModes.scalar,
+            )
+            return count or 0, False
+
+        if (
+            DBCOLUMNS.text_searchable not in filters
+            and DBCOLUMNS.embedding not in filters
+        ):
+            try:
+                estimate = DBConnector.estimate_count(engine, table, filters)
+            except Exception as e:
+                logger.warning(f"Failed to estimate the count: {e}")
+                estimate = None
+            if estimate is not None and estimate > DBConnector.EXACT_COUNT_LIMIT:
+                return estimate, True
+
+        count = DBConnector.get_total_count(
+            engine, table, filters, result_mode=ResultModes.scalar
+        )
+        return count or 0, False
+
     @execute
     @staticmethod
     def get_done_dates(table_ref, filters=None):
+        query = select(table_ref.c[CRAWLCOLUMNS.date]).where(
+            table_ref.c[CRAWLCOLUMNS.status] == CrawlStatus.done
+        )
+        query = DBConnector.apply_filters(query, table_ref, filters)
+        select_from = query.get_final_froms()[0]
+        return query.order_by(select_from.c[CRAWLCOLUMNS.date])
+
+    @execute
+    @staticmethod
+    def save_crawl_state(table_ref, values):
+        columns = values[0] if isinstance(values, list) else values
+        insert_stmt = insert(table_ref).values(values)
+        insert_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=[CRAWLCOLUMNS.archive.value, CRAWLCOLUMNS.date.value],
+            set_={
+                col: insert_stmt.excluded[col]
+                for col in columns
+                if col not in [CRAWLCOLUMNS.archive, CRAWLCOLUMNS.date]
+            },
+        )
+        return insert_stmt
+
+    @execute
+    @staticmethod
+    def estimate_done_dates(table_ref, filters=None):
+        """
+        Dates whose article count is above 90% of the median, used to fill
+        the crawl state of archives collected before it existed.
+        """
         query = select(
             table_ref.c[DBCOLUMNS.date].label("date"), func.count().label("freq")
         )
@@ -240,32 +1226,43 @@ class DBConnector:
 
     @execute
     @staticmethod
-    def get_archive_freq(table_ref, filters=None):
-        query = select(table_ref.c[DBCOLUMNS.archive], func.count())
+    def get_daily_count(table_ref, filters=None):
+        query = select(func.coalesce(func.sum(table_ref.c[DAILYCOLUMNS.count]), 0))
+        return DBConnector.apply_filters(query, table_ref, filters)
+
+    @staticmethod
+    def get_archive_freq(engine, table, filters=None, **kwargs):
+        daily_filters = DBConnector.get_daily_filters(engine, table, filters)
+        if daily_filters is not None:
+            return DBConnector.get_daily_archive_freq(
+                engine, DBConnector.get_daily_table(table), daily_filters, **kwargs
+            )
+        return DBConnector.get_rows_archive_freq(engine, table, filters, **kwargs)
+
+    @execute
+    @staticmethod
+    def get_daily_archive_freq(table_ref, filters=None):
+        count = func.sum(table_ref.c[DAILYCOLUMNS.count])
+        query = select(table_ref.c[DAILYCOLUMNS.archive], count)
         query = DBConnector.apply_filters(query, table_ref, filters)
-        select_from = query.get_final_froms()[0]
-        query = query.group_by(select_from.c[DBCOLUMNS.archive]).order_by(
-            func.count().desc()
+        return (
+            query.group_by(table_ref.c[DAILYCOLUMNS.archive])
+            .having(count > 0)
+            .order_by(count.desc())
         )
-        return query
 
     @execute
     @staticmethod
-    def get_tags(table_ref, filters=None):
-        query = select(table_ref.c[DBCOLUMNS.tag]).select_from(table_ref)
+    def get_rows_archive_freq(table_ref, filters=None):
+        query = select(table_ref.c[DBCOLUMNS.archive], func.count())
         query = DBConnector.apply_filters(query, table_ref, filters)
         select_from = query.get_final_froms()[0]
-
-        query = (
-            select(
-                func.trim(func.upper(select_from.c[DBCOLUMNS.tag])),
-            )
-            .group_by(func.trim(func.upper(select_from.c[DBCOLUMNS.tag])))
-            .order_by(func.count().desc())
-            .limit(100)
+        query = query.group_by(select_from.c[DBCOLUMNS.archive]).order_by(
+            func.count().desc()
         )
         return query
 
+    @cached(ttl=KEYSET_CACHE_TTL)
     @execute
     @staticmethod
     def fetch_data_keyset(
@@ -320,9 +1317,38 @@ class DBConnector:
 
         return query
 
+    @cached(ttl=GROUP_BY_CACHE_TTL)
+    @staticmethod
+    def group_by(engine, table, value, filters=None, **kwargs):
+        """
+        Article count per day, month or year. Served from the daily counts
+        unless the filters contain a text or vector search.
+        """
+        daily_filters = DBConnector.get_daily_filters(engine, table, filters)
+        if daily_filters is not None:
+            return DBConnector.group_by_daily(
+                engine,
+                DBConnector.get_daily_table(table),
+                value,
+                daily_filters,
+                **kwargs,
+            )
+        return DBConnector.group_by_rows(engine, table, value, filters, **kwargs)
+
     @execute
     @staticmethod
-    def group_by(table_ref, value, filters=None):
+    def group_by_daily(table_ref, value, filters=None):
+        assert value in ["day", "month", "year"]
+
+        period = func.date_trunc(value, table_ref.c[DAILYCOLUMNS.date])
+        count = func.sum(table_ref.c[DAILYCOLUMNS.count])
+        query = select(period.label(value), count.label("count"))
+        query = DBConnector.apply_filters(query, table_ref, filters)
+        return query.group_by(value).having(count > 0).order_by(value)
+
+    @execute
+    @staticmethod
+    def group_by_rows(table_ref, value, filters=None):
         assert value in ["day", "month", "year"]
 
         base_query = select(table_ref)
@@ -337,9 +1363,28 @@ class DBConnector:
         query = query.group_by(value).order_by(value)
         return query
 
+    @staticmethod
+    def get_min_max_dates(engine, table, filters=None, **kwargs):
+        daily_filters = DBConnector.get_daily_filters(engine, table, filters)
+        if daily_filters is not None:
+            return DBConnector.get_daily_min_max_dates(
+                engine, DBConnector.get_daily_table(table), daily_filters, **kwargs
+            )
+        return DBConnector.get_rows_min_max_dates(engine, table, filters, **kwargs)
+
+    @execute
+    @staticmethod
+    def get_daily_min_max_dates(table_ref, filters=None):
+        query = select(
+            func.min(table_ref.c[DAILYCOLUMNS.date]),
+            func.max(table_ref.c[DAILYCOLUMNS.date]),
+        )
+        query = DBConnector.apply_filters(query, table_ref, filters)
+        return query.where(table_ref.c[DAILYCOLUMNS.count] > 0)
+
     @execute
     @staticmethod
-    def get_min_max_dates(table_ref, filters=None):
+    def get_rows_min_max_dates(table_ref, filters=None):
         base_query = select(table_ref)
         filtered_query = DBConnector.apply_filters(base_query, table_ref, filters)
 
@@ -356,12 +1401,116 @@ class DBConnector:
         insert_stmt = insert(table_ref).values(values).on_conflict_do_nothing()
         return insert_stmt
 
+    @staticmethod
+    def insert_rows_binary(engine, table, values):
+        """
+        Insert the rows with a binary COPY into a staging table, so that the
+        embeddings are sent as halfvec bytes. Duplicates are skipped like in
+        `insert_row`. The new tags of the rows are added first, in order and in
+        one statement, so that concurrent inserts can't deadlock on them in the
+        row trigger, which then only looks them up.
+        """
+        columns = ", ".join(col.value for col in BinaryCopy.COLUMNS)
+        staging = f"{table}_staging"
+        tags = DBConnector.get_tags_table(table)
+        buffer = BinaryCopy.encode_rows(values)
+        DBConnector.add_partitions(
+            engine, table, {value[DBCOLUMNS.date].year for value in values}
+        )
+
+        connection = engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS "
+                    f"SELECT {columns} FROM {table} WITH NO DATA"
+                )
+                cursor.copy_expert(
+                    f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT BINARY)",
+                    buffer,
+                )
+                cursor.execute("SELECT to_regclass(%s)", (tags,))
+                if cursor.fetchone()[0] is not None:
+                    cursor.execute(
+                        f"INSERT INTO {tags} (name, count) SELECT name, 0 FROM ("
+                        f"SELECT DISTINCT nullif(upper(trim(tag)), '') AS name "
+                        f"FROM {staging}) AS names WHERE name IS NOT NULL "
+                        f"AND NOT EXISTS (SELECT 1 FROM {tags} WHERE "
+                        f"{tags}.name = names.name) "
+                        "ORDER BY 1 ON CONFLICT (name) DO NOTHING"
+                    )
+                cursor.execute(
+                    f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} "
+                    "ON CONFLICT DO NOTHING"
+                )
+                rowcount = cursor.rowcount
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+        if rowcount:
+            QueryCache().bump(table)
+        return rowcount
+
+    @staticmethod
+    def export_embeddings(engine, table, filters=None, limit=None):
+        """Return the rowids and float16 embeddings of the filtered rows."""
+        table_ref = TableCache.get(engine, table)
+        if table_ref is None:
+            return None
+
+        query = select(table_ref.c[DBCOLUMNS.rowid], table_ref.c[DBCOLUMNS.embedding])
+        query = DBConnector.apply_filters(query, table_ref, filters)
+        select_from = query.get_final_froms()[0]
+        query = query.where(select_from.c[DBCOLUMNS.embedding].isnot(None))
+        if limit is not None:
+            query = query.limit(limit)
+        query_str = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+
+        buffer = BytesIO()
+        connection = engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY ({query_str}) TO STDOUT WITH (FORMAT BINARY)", buffer
+                )
+            connection.commit()
+        finally:
+            connection.close()
+
+        return BinaryCopy.decode_embeddings(buffer.getvalue(), DBConnector.VECTOR_DIM)
+
+    @execute
+    @staticmethod
+    def update_row(table_ref, rowid, values, date=None, archive=None):
+        """
+        The `date` and `archive` of the row, when given, let postgres prune the
+        partitions of a partitioned table, instead of reading the rowid index
+        of each of them.
+        """
+        conditions = [table_ref.c[DBCOLUMNS.rowid] == rowid]
+        if date is not None:
+            conditions.append(table_ref.c[DBCOLUMNS.date] == date)
+        if archive is not None:
+            conditions.append(table_ref.c[DBCOLUMNS.archive] == archive)
+        update_stmt = update(table_ref).where(*conditions).values(values)
+        return update_stmt
+
 
 class DynamicFilters:
     TOP_K = os.getenv("HNSW_EF_SEARCH", 100)
     THRESHOLD = 0
-    VECTOR_WEIGHT = 2.0
-    BM25_WEIGHT = 1.0
+    RRF_K = 60
+    VECTOR_WEIGHT = float(os.getenv("VECTOR_WEIGHT", 2.0))
+    BM25_WEIGHT = float(os.getenv("BM25_WEIGHT", 1.0))
+    HYBRID_MODE = os.getenv("HYBRID_SEARCH", HybridModes.parallel.value)
+    PREFILTER_ROWS = int(os.getenv("PREFILTER_ROWS", 20_000))
+    EXACT_SEARCH_ROWS = int(os.getenv("EXACT_SEARCH_ROWS", 5_000))
+    EXACT_BATCH_SIZE = 4096
+    HNSW_MAX_SCAN_TUPLES = int(os.getenv("HNSW_MAX_SCAN_TUPLES", 200_000))
 
     operator_map = {
         OPERATORS.eq: lambda column, value: column == value,
@@ -403,16 +1552,18 @@ class DynamicFilters:
             ts_ops = filters.pop(ts_key)
             vec_ops = filters.pop(sim_key)
             base = DynamicFilters._create_rrf_subquery_optimized(
-                table_ref, ts_ops, vec_ops
+                table_ref, ts_ops, vec_ops, filters
             )
 
         elif has_text_search:
             ts_ops = filters.pop(ts_key)
-            base = DynamicFilters._create_text_search_base(table_ref, ts_ops)
+            base = DynamicFilters._create_text_search_base(table_ref, ts_ops, filters)
 
         elif has_vector_search:
             vec_ops = filters.pop(sim_key)
-            base = DynamicFilters._create_vector_search_base(table_ref, vec_ops)
+            base = DynamicFilters._create_vector_search_base(
+                table_ref, vec_ops, filters
+            )
 
         else:
             base = table_ref
@@ -420,7 +1571,7 @@ class DynamicFilters:
         return DynamicFilters._build_final_query(query, table_ref, base, filters)
 
     @staticmethod
-    def _create_text_search_base(table_ref, ts_ops):
+    def _create_text_search_base(table_ref, ts_ops, filters=None):
         """Create base query for text search without normalization to avoid OOM."""
         ts_op, ts_query = ts_ops[0]
 
@@ -438,17 +1589,21 @@ class DynamicFilters:
 
         text_base = (
             select(*table_ref.c, raw_text)
-            .where(ts_query_match)
+            .where(ts_query_match, *DynamicFilters.get_conditions(table_ref, filters))
             .order_by(raw_text.desc())
             .limit(DynamicFilters.TOP_K)
             .subquery("text_search_base")
         )
 
-        return (text_base,)
+        return text_base
 
     @staticmethod
-    def _create_vector_search_base(table_ref, vec_ops):
-        """Create base query for vector search only."""
+    def _create_vector_search_base(table_ref, vec_ops, filters=None):
+        """
+        Create base query for vector search only. The filters are applied
+        during the HNSW scan, which the iterative scan continues until enough
+        rows pass them.
+        """
         op, vec = vec_ops[0]
 
         vec_score = DynamicFilters.operator_map[op](
@@ -464,6 +1619,7 @@ class DynamicFilters:
                 and_(
                     notnull,
                     vec_score < literal(DynamicFilters.THRESHOLD),
+                    *DynamicFilters.get_conditions(table_ref, filters),
                 )
             )
             .order_by(vec_score.asc())
@@ -473,11 +1629,9 @@ class DynamicFilters:
         return subq
 
     @staticmethod
-    def _create_rrf_subquery_optimized(table_ref, ts_ops, vec_ops):
+    def get_text_leg(table_ref, ts_ops, filters=None):
+        """The `TOP_K` rowids matching the text search and filters, with their rank."""
         ts_op, ts_query = ts_ops[0]
-        vec_op, vec = vec_ops[0]
-
-        RRF_K = 60
 
         tsq = func.plainto_tsquery(
             literal_column("'french'").cast(REGCONFIG),
@@ -489,54 +1643,128 @@ class DynamicFilters:
             table_ref.c[DBCOLUMNS.text_searchable], ts_query
         )
 
-        text_ranked = (
+        return (
             select(
                 table_ref.c[DBCOLUMNS.rowid],
-                text_score.label("text_score"),
                 func.row_number().over(order_by=text_score.desc()).label("text_rank"),
             )
-            .where(ts_match)
+            .where(ts_match, *DynamicFilters.get_conditions(table_ref, filters))
             .order_by(text_score.desc())
             .limit(DynamicFilters.TOP_K)
-            .cte("text_ranked")
         )
 
+    @staticmethod
+    def get_vector_leg(table_ref, vec_ops, filters=None, path=VectorPaths.hnsw):
+        """
+        The `TOP_K` nearest rowids matching the filters, with their rank.
+        With the `hnsw` path the filters are checked during the index scan.
+        With `prefilter`, the rows matching the filters are read first through
+        their indexes, in a materialized CTE the HNSW index can't reach, and
+        the distance is computed for each of them. The CTE stops after
+        `PREFILTER_ROWS`, so that an estimate far too low can't make it
+        compute millions of distances, and the number of rows it read is
+        returned on each row, on a single empty row without a match, for the
+        caller to tell a truncated ranking.
+        """
+        vec_op, vec = vec_ops[0]
+        conditions = [
+            DynamicFilters.operator_map[OPERATORS.notnull](
+                table_ref.c[DBCOLUMNS.embedding], None
+            ),
+            *DynamicFilters.get_conditions(table_ref, filters),
+        ]
+
+        source = table_ref
+        if VectorPaths(path) == VectorPaths.prefilter:
+            source = (
+                select(table_ref.c[DBCOLUMNS.rowid], table_ref.c[DBCOLUMNS.embedding])
+                .where(*conditions)
+                .limit(DynamicFilters.PREFILTER_ROWS + 1)
+                .cte("filtered")
+                .prefix_with("MATERIALIZED")
+            )
+            conditions = []
+
         vec_score = DynamicFilters.operator_map[vec_op](
-            table_ref.c[DBCOLUMNS.embedding], vec
-        )
-        vec_notnull = DynamicFilters.operator_map[OPERATORS.notnull](
-            table_ref.c[DBCOLUMNS.embedding], None
+            source.c[DBCOLUMNS.embedding], vec
         )
-
-        vector_ranked = (
+        ranked = (
             select(
-                table_ref.c[DBCOLUMNS.rowid],
-                vec_score.label("vec_score"),
+                source.c[DBCOLUMNS.rowid],
                 func.row_number().over(order_by=vec_score.asc()).label("vec_rank"),
             )
-            .where(
-                and_(
-                    vec_notnull,
-                    vec_score < literal(DynamicFilters.THRESHOLD),
-                )
-            )
+            .where(vec_score < literal(DynamicFilters.THRESHOLD), *conditions)
             .order_by(vec_score.asc())
             .limit(DynamicFilters.TOP_K)
-            .cte("vector_ranked")
+        )
+        if source is table_ref:
+            return ranked
+
+        ranked = ranked.subquery("ranked")
+        counted = select(func.count().label("filtered")).select_from(source).subquery()
+        return (
+            select(counted.c.filtered, ranked.c.rowid, ranked.c.vec_rank)
+            .select_from(counted.outerjoin(ranked, true()))
+            .order_by(ranked.c.vec_rank)
+        )
+
+    @staticmethod
+    def rank_exact(rowids, embeddings, vec_ops):
+        """
+        The `exact` vector path: the `TOP_K` rows of smallest
+        `<#>`, the negative inner product, with their rank. The embeddings are
+        converted to float32 one batch at a time, and only the best rows of the
+        batches seen so far are kept.
+        """
+        vec_op, vec = vec_ops[0]
+        assert vec_op == OPERATORS.vs, f"Unknown operator {vec_op!r}"
+        query = np.asarray(vec, dtype=np.float32)
+        limit = int(DynamicFilters.TOP_K)
+
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(rowids), DynamicFilters.EXACT_BATCH_SIZE):
+            end = start + DynamicFilters.EXACT_BATCH_SIZE
+            scores = -(embeddings[start:end].astype(np.float32) @ query)
+            keep = scores < DynamicFilters.THRESHOLD
+            best_ids = np.concatenate([best_ids, rowids[start:end][keep]])
+            best_scores = np.concatenate([best_scores, scores[keep]])
+            if len(best_scores) > limit:
+                top = np.argpartition(best_scores, limit - 1)[:limit]
+                best_ids, best_scores = best_ids[top], best_scores[top]
+
+        order = np.lexsort((best_ids, best_scores))
+        return [[int(rowid), rank] for rank, rowid in enumerate(best_ids[order], 1)]
+
+    @staticmethod
+    def get_weight(ops, default):
+        """The fusion weight set on the ops of a search filter, else `default`."""
+        return next((value for op, value in ops if op == OPERATORS.weight), default)
+
+    @staticmethod
+    def _create_rrf_subquery_optimized(table_ref, ts_ops, vec_ops, filters=None):
+        RRF_K = DynamicFilters.RRF_K
+        bm25_weight = DynamicFilters.get_weight(ts_ops, DynamicFilters.BM25_WEIGHT)
+        vector_weight = DynamicFilters.get_weight(vec_ops, DynamicFilters.VECTOR_WEIGHT)
+        text_ranked = DynamicFilters.get_text_leg(table_ref, ts_ops, filters).cte(
+            "text_ranked"
+        )
+        vector_ranked = DynamicFilters.get_vector_leg(table_ref, vec_ops, filters).cte(
+            "vector_ranked"
         )
 
         text_contribution = select(
             text_ranked.c[DBCOLUMNS.rowid],
-            (
-                literal(DynamicFilters.BM25_WEIGHT) / (RRF_K + text_ranked.c.text_rank)
-            ).label("contribution"),
+            (literal(bm25_weight) / (RRF_K + text_ranked.c.text_rank)).label(
+                "contribution"
+            ),
         )
 
         vector_contribution = select(
             vector_ranked.c[DBCOLUMNS.rowid],
-            (
-                literal(DynamicFilters.BM25_WEIGHT) / (RRF_K + vector_ranked.c.vec_rank)
-            ).label("contribution"),
+            (literal(vector_weight) / (RRF_K + vector_ranked.c.vec_rank)).label(
+                "contribution"
+            ),
         )
 
         all_contributions = text_contribution.union_all(vector_contribution).cte(
@@ -580,22 +1808,27 @@ class DynamicFilters:
 
         new_query = select(*remapped_cols).select_from(base_table_ref)
 
+        where_conditions = DynamicFilters.get_conditions(
+            base_table_ref, remaining_filters
+        )
+        if where_conditions:
+            new_query = new_query.where(and_(*where_conditions))
+
+        return new_query
+
+    @staticmethod
+    def get_conditions(table_ref, filters):
         where_conditions = []
 
-        for col_name, ops in remaining_filters.items():
-            col = getattr(base_table_ref.c, col_name, None)
-            assert (
-                col is not None
-            ), f"Column {col_name!r} not found on {base_table_ref.name}"
+        for col_name, ops in (filters or {}).items():
+            col = getattr(table_ref.c, col_name, None)
+            assert col is not None, f"Column {col_name!r} not found on {table_ref.name}"
 
             for op, val in ops:
                 assert op in DynamicFilters.operator_map, f"Unknown operator {op!r}"
                 where_conditions.append(DynamicFilters.operator_map[op](col, val))
 
-        if where_conditions:
-            new_query = new_query.where(and_(*where_conditions))
-
-        return new_query
+        return where_conditions
 
     @staticmethod
     def _remap_columns(original_query, orig_table_ref, new_table_ref):
@@ -26,6 +26,40 @@ class DBCOLUMNS(str, Enum):
     hash = "hash"
     embedding = "embedding"
     text_searchable = "text_searchable"
+    tag_id = "tag_id"
+
+
+class CRAWLCOLUMNS(str, Enum):
+    archive = "archive"
+    date = "date"
+    status = "status"
+    sections = "sections"
+    articles = "articles"
+    empty_visits = "empty_visits"
+    error = "error"
+    started_at = "started_at"
+    finished_at = "finished_at"
+
+
+class DAILYCOLUMNS(str, Enum):
+    archive = "archive"
+    date = "date"
+    has_image = "has_image"
+    tag = "tag"
+    tag_id = "tag_id"
+    count = "count"
+
+
+class TAGCOLUMNS(str, Enum):
+    tag_id = "tag_id"
+    name = "name"
+    count = "count"
+
+
+class CrawlStatus(str, Enum):
+    done = "done"
+    partial = "partial"
+    failed = "failed"
 
 
 class OPERATORS(str, Enum):
@@ -40,15 +74,65 @@ class OPERATORS(str, Enum):
     notnull = "notnull"
     ts = "text_search"
     vs = "vector_search"
+    # fusion weight of a text or vector search, not a condition
+    weight = "weight"
+
+
+class ResultModes(str, Enum):
+    rows = "rows"
+    frame = "frame"
+    scalar = "scalar"
+    stream = "stream"
+
+
+class CrawlSchedules(str, Enum):
+    recent = "recent"
+    gaps = "gaps"
+
+
+class PartitionLayouts(str, Enum):
+    none = "none"
+    year = "year"
+    year_archive = "year_archive"
+
+
+class HybridModes(str, Enum):
+    sql = "sql"
+    parallel = "parallel"
+
+
+class VectorPaths(str, Enum):
+    hnsw = "hnsw"
+    prefilter = "prefilter"
+    exact = "exact"
 
 
 class CeleryTasks(str, Enum):
     collect = "collect"
+    collect_chunk = "collect_chunk"
+    prepare_collect = "prepare_collect"
     download = "download"
+    images = "images"
+    image = "image"
+    embeddings = "embeddings"
+    details = "details"
+
+
+class CeleryQueues(str, Enum):
+    collect = "collect"
+    download = "download"
+    backfill = "embed-backfill"
+    ui = "ui"
+
+
+class ImageBackends(str, Enum):
+    files = "files"
+    packed = "packed"
 
 
 class JobsKeys(str, Enum):
     TASKID = "TASKID"
+    GROUPID = "GROUPID"
     TASKNAME = "TASKNAME"
     STATUS = "STATUS"
 
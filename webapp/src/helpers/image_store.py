@@ -0,0 +1,252 @@
+import os
+import fcntl
+import hashlib
+import logging
+import argparse
+import threading
+import numpy as np
+
+from src.helpers.enum import ImageBackends
+
+logger = logging.getLogger(__name__)
+
+
+class FileBackend:
+    """One webp file per image under <data_dir>/<year>/<month>/<sha>.webp"""
+
+    def prepare(self, file_path):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+    def write(self, file_path, image_bytes):
+        with open(file_path, "wb") as file:
+            file.write(image_bytes)
+
+    def read(self, file_path):
+        try:
+            with open(file_path, "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def has(self, file_path):
+        return os.path.exists(file_path)
+
+
+class PackedBackend:
+    """
+    Appends images to large segment files instead of creating one file per image.
+
+    The index is an append-only file of fixed size records
+    (key, segment, offset, length), where the key is the sha256 found in the
+    image path returned by `get_image_path`. The paths stored in the database
+    stay the same, so both layouts can be read during a migration.
+    Writers from several processes are serialized with a lock on the index file.
+    """
+
+    SEGMENT_SIZE = int(os.getenv("IMAGE_SEGMENT_SIZE", 1 << 30))
+    MERGE_THRESHOLD = 100_000
+    INDEX_DTYPE = np.dtype(
+        [("key", "S32"), ("segment", "<u4"), ("offset", "<u8"), ("length", "<u4")]
+    )
+
+    def __init__(self, pack_dir):
+        self._pack_dir = pack_dir
+        os.makedirs(self._pack_dir, exist_ok=True)
+        self._index_path = os.path.join(self._pack_dir, "index.bin")
+        self._lock = threading.Lock()
+        self._read_fds = {}
+        self._keys = np.empty(0, dtype=self.INDEX_DTYPE)
+        self._recent = {}
+        self._index_size = 0
+        self._refresh_index()
+
+    def _segment_path(self, segment):
+        return os.path.join(self._pack_dir, f"segment_{segment:05d}.bin")
+
+    @staticmethod
+    def _get_key(file_path):
+        # numpy strips the trailing null bytes of "S32" values
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        try:
+            key = bytes.fromhex(name)
+            if len(key) == 32:
+                return key.rstrip(b"\x00")
+        except ValueError:
+            pass
+        return hashlib.sha256(file_path.encode("utf-8")).digest().rstrip(b"\x00")
+
+    def _refresh_index(self):
+        """Load the records appended to the index since the last refresh."""
+        if not os.path.exists(self._index_path):
+            return
+        size = os.path.getsize(self._index_path)
+        count = (size - self._index_size) // self.INDEX_DTYPE.itemsize
+        if count <= 0:
+            return
+
+        records = np.fromfile(
+            self._index_path,
+            dtype=self.INDEX_DTYPE,
+            count=count,
+            offset=self._index_size,
+        )
+        self._index_size += count * self.INDEX_DTYPE.itemsize
+        for record in records:
+            self._recent[record["key"]] = (
+                int(record["segment"]),
+                int(record["offset"]),
+                int(record["length"]),
+            )
+        if len(self._recent) > self.MERGE_THRESHOLD:
+            self._merge_recent()
+
+    def _merge_recent(self):
+        recent = np.array(
+            [(key, *location) for key, location in self._recent.items()],
+            dtype=self.INDEX_DTYPE,
+        )
+        merged = np.concatenate([self._keys, recent])
+        order = np.argsort(merged["key"], kind="stable")
+        merged = merged[order]
+        is_last = np.append(merged["key"][1:] != merged["key"][:-1], True)
+        self._keys = merged[is_last]
+        self._recent = {}
+
+    def _lookup(self, key):
+        if key in self._recent:
+            return self._recent[key]
+        position = np.searchsorted(self._keys["key"], key)
+        if position < len(self._keys) and self._keys["key"][position] == key:
+            record = self._keys[position]
+            return int(record["segment"]), int(record["offset"]), int(record["length"])
+        return None
+
+    def _current_segment(self, length):
+        segment = 0
+        while os.path.exists(self._segment_path(segment + 1)):
+            segment += 1
+        path = self._segment_path(segment)
+        if os.path.exists(path) and os.path.getsize(path) + length > self.SEGMENT_SIZE:
+            segment += 1
+        return segment
+
+    def prepare(self, file_path):
+        pass
+
+    def write(self, file_path, image_bytes):
+        key = self._get_key(file_path)
+        with self._lock, open(self._index_path, "ab") as index_file:
+            fcntl.flock(index_file, fcntl.LOCK_EX)
+            try:
+                segment = self._current_segment(len(image_bytes))
+                with open(self._segment_path(segment), "ab") as segment_file:
+                    offset = segment_file.tell()
+                    segment_file.write(image_bytes)
+
+                record = np.array(
+                    [(key, segment, offset, len(image_bytes))], dtype=self.INDEX_DTYPE
+                )
+                index_file.write(record.tobytes())
+                index_file.flush()
+            finally:
+                fcntl.flock(index_file, fcntl.LOCK_UN)
+
+    def read(self, file_path):
+        key = self._get_key(file_path)
+        with self._lock:
+            location = self._lookup(key)
+            if location is None:
+                self._refresh_index()
+                location = self._lookup(key)
+            if location is None:
+                return FileBackend().read(file_path)
+
+            segment, offset, length = location
+            fd = self._read_fds.get(segment)
+            if fd is None:
+                fd = os.open(self._segment_path(segment), os.O_RDONLY)
+                self._read_fds[segment] = fd
+        return os.pread(fd, length, offset)
+
+    def has(self, file_path):
+        key = self._get_key(file_path)
+        with self._lock:
+            self._refresh_index()
+            return self._lookup(key) is not None
+
+
+class ImageStore:
+    _backend = None
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(ImageStore, cls).__new__(cls)
+        return cls._instance
+
+    @property
+    def backend(self):
+        """Get the image backend selected by the IMAGE_BACKEND env variable"""
+        if self._backend is None:
+            self._backend = self._create_backend()
+        return self._backend
+
+    @staticmethod
+    def _create_backend():
+        backend = os.getenv("IMAGE_BACKEND", ImageBackends.files)
+        assert backend in list(ImageBackends), f"Unknown image backend {backend!r}"
+
+        if backend == ImageBackends.packed:
+            return PackedBackend(os.getenv("IMAGE_PACK_DIR", "/images/packs/"))
+        return FileBackend()
+
+    def prepare(self, file_path):
+        self.backend.prepare(file_path)
+
+    def write(self, file_path, image_bytes):
+        self.backend.write(file_path, image_bytes)
+
+    def read(self, file_path):
+        return self.backend.read(file_path)
+
+
+def convert_to_packed(data_dir, pack_dir, delete=False):
+    """Move the images of the one-file-per-image layout into segment files."""
+    backend = PackedBackend(pack_dir)
+    converted = 0
+    for root, dirs, files in os.walk(data_dir):
+        dirs[:] = [
+            d for d in dirs if os.path.abspath(os.path.join(root, d)) != pack_dir
+        ]
+        for name in files:
+            if not name.endswith(".webp"):
+                continue
+            file_path = os.path.join(root, name)
+            if not backend.has(file_path):
+                image_bytes = FileBackend().read(file_path)
+                if image_bytes is None:
+                    continue
+                backend.write(file_path, image_bytes)
+                converted += 1
+                if not converted % 10_000:
+                    logger.info(f"{converted} images were packed")
+            if delete:
+                os.remove(file_path)
+
+    logger.info(f"{converted} images were packed into {pack_dir}")
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-d", "--data_dir", type=str, default="/images/")
+    parser.add_argument("-p", "--pack_dir", type=str, default="/images/packs/")
+    parser.add_argument(
+        "--delete", action="store_true", help="remove the files once packed"
+    )
+    args = parser.parse_args()
+
+    convert_to_packed(
+        os.path.abspath(args.data_dir), os.path.abspath(args.pack_dir), args.delete
+    )
@@ -0,0 +1,127 @@
+import inspect
+import argparse
+import statistics
+from datetime import date, timedelta
+
+from src.utils.logging import logging
+from src.utils.utils import TableCache
+from src.helpers.enum import DBCOLUMNS, OPERATORS
+from src.helpers.db_connector import DBConnector, DBManager
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_index_names(plan):
+    names = {plan["Index Name"]} if "Index Name" in plan else set()
+    for child in plan.get("Plans", []):
+        names |= get_index_names(child)
+    return names
+
+
+def explain(connection, engine, query):
+    compiled = query.compile(engine, compile_kwargs={"render_postcompile": True})
+    plan = connection.exec_driver_sql(
+        f"EXPLAIN (ANALYZE, FORMAT JSON) {compiled}", compiled.params
+    ).scalar()[0]
+    return plan["Execution Time"], get_index_names(plan["Plan"])
+
+
+def measure(engine, query, repeat, drop=None):
+    """
+    Median execution time of the query in ms, and the indexes it used. With
+    `drop`, the index is dropped in a transaction rolled back at the end, which
+    locks the table meanwhile: run the benchmark on a copy or a quiet database.
+    """
+    with engine.connect() as connection:
+        with connection.begin() as transaction:
+            if drop is not None:
+                connection.exec_driver_sql(f"DROP INDEX {drop}")
+            explain(connection, engine, query)
+            timings = []
+            for _ in range(repeat):
+                timing, indexes = explain(connection, engine, query)
+                timings.append(timing)
+            transaction.rollback()
+    return statistics.median(timings), indexes
+
+
+def get_cases(table, archives, tag, begin_date, end_date):
+    """The filters each filter index is meant for, `tag` being a (tag_id, name) row."""
+    date_range = [(OPERATORS.ge, begin_date), (OPERATORS.le, end_date)]
+    tag_id, _ = tag
+    cases = {
+        f"{table}_archive_date_rowid_index": {
+            DBCOLUMNS.archive: [(OPERATORS.in_, archives)],
+            DBCOLUMNS.date: date_range,
+        },
+        f"{table}_tag_id_date_rowid_index": {
+            DBCOLUMNS.tag_id: [(OPERATORS.eq, tag_id)]
+        },
+        f"{table}_image_date_rowid_index": {
+            DBCOLUMNS.image: [(OPERATORS.notnull, None)],
+            DBCOLUMNS.date: date_range,
+        },
+    }
+    indexes = DBConnector.get_filter_indexes(table)
+    assert set(cases) == set(indexes), "Every filter index needs a case"
+    return cases
+
+
+def benchmark(engine, table, archives, tag, begin_date, end_date, repeat=5):
+    """Time the article page and the count of each case with and without its index."""
+    table_ref = TableCache.get(engine, table)
+    assert table_ref is not None, f"{table} does not exist"
+    DBConnector.add_filter_indexes(engine, table)
+
+    # the query builders, without the cache and execute wrappers
+    fetch_page = inspect.unwrap(DBConnector.fetch_data_keyset)
+    count = inspect.unwrap(DBConnector.get_total_count)
+
+    results = []
+    for index, filters in get_cases(table, archives, tag, begin_date, end_date).items():
+        queries = {
+            "page": fetch_page(
+                table_ref,
+                limit=60,
+                filters=filters,
+                columns=[DBCOLUMNS.rowid, DBCOLUMNS.date, DBCOLUMNS.title],
+            ),
+            "count": count(table_ref, filters),
+        }
+        for name, query in queries.items():
+            with_index, used = measure(engine, query, repeat)
+            without_index, _ = measure(engine, query, repeat, drop=index)
+            results.append((index, name, with_index, without_index))
+            logger.info(
+                f"{index} {name}: {without_index:.1f} ms -> {with_index:.1f} ms "
+                f"({without_index / max(with_index, 1e-3):.1f}x), "
+                f"plan uses {', '.join(sorted(used)) or 'no index'}"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-t", "--table", type=str, default=DBConnector.TABLE)
+    parser.add_argument("-a", "--archives", nargs="+", default=None)
+    parser.add_argument("--tag", type=str, default=None)
+    parser.add_argument("-d", "--days", type=int, default=365)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = DBManager().engine
+    archives = args.archives
+    if not archives:
+        freq = DBConnector.get_archive_freq(engine, args.table)
+        archives = [archive for archive, _ in freq[:2]]
+    tags = DBConnector.search_tags(
+        engine, DBConnector.get_tags_table(args.table), args.tag, limit=1
+    )
+    assert tags, "No tag found, create the tags table first"
+    tag = tags[0]
+    end_date = date.today()
+    begin_date = end_date - timedelta(days=args.days)
+
+    benchmark(engine, args.table, archives, tag, begin_date, end_date, args.repeat)
@@ -5,9 +5,11 @@ from datetime import datetime
 import plotly.graph_objs as go
 from dash_iconify import DashIconify
 import dash_mantine_components as dmc
-from src.helpers.enum import Archives, DBCOLUMNS
+from src.helpers.enum import Archives, DBCOLUMNS, ResultModes, VectorPaths
 from src.helpers.db_connector import DBConnector, DBManager
 from src.utils.utils import resize_image_for_html, convert_count_to_str
+from src.data_scrapping.deferred_images import DeferredImages
+from src.utils.celery_tasks import image_task
 
 db_manager = DBManager()
 
@@ -148,14 +150,34 @@ class Navbar:
         )
         return date
 
+    @staticmethod
+    def get_tag_options(prefix=None, selected=None):
+        """Most frequent tags starting with `prefix`, keeping the selected one."""
+        tags = DBConnector.search_tags(
+            db_manager.engine,
+            DBConnector.get_tags_table(DBConnector.TABLE),
+            prefix,
+            result_mode=ResultModes.frame,
+        )
+        tags = tags.values.tolist() if tags is not None else []
+        if selected and all(str(tag_id) != selected for tag_id, _ in tags):
+            tags += DBConnector.search_tags(
+                db_manager.engine,
+                DBConnector.get_tags_table(DBConnector.TABLE),
+                tag_ids=[int(selected)],
+                result_mode=ResultModes.frame,
+            ).values.tolist()
+        return [
+            {"value": str(tag_id), "label": name.title()}
+            for tag_id, name in tags
+            if not name.isnumeric()
+        ]
+
     @staticmethod
     def filter_by_tag():
-        tags = DBConnector.get_tags(db_manager.engine, DBConnector.TABLE)
-        tags = tags if tags is not None else []
-        tags = [tag.title() for tag in tags if tag and not tag.isnumeric()]
         select = dmc.Select(
             id="tag",
-            data=tags,
+            data=Navbar.get_tag_options(),
             label=dmc.Text("Topic", c="dimmed", fw=300),
             placeholder="Search by topic",
             checkIconPosition="right",
@@ -170,8 +192,14 @@ class Navbar:
         return select
 
     @staticmethod
-    def get_badge(count):
+    def get_badge(count, approximate=False, vector_path=None):
         approx = convert_count_to_str(count)
+        approx = f"~{approx}" if approximate else approx
+        label = (
+            f"About {count} articles (estimate)" if approximate else f"{count} articles"
+        )
+        if vector_path is not None:
+            label = f"{label}, {VectorPaths(vector_path).value} vector search"
         badge = dmc.Tooltip(
             dmc.Badge(
                 dmc.Text(approx, fw=300, size="xs"),
@@ -182,7 +210,7 @@ class Navbar:
                 circle=True,
                 p=2,
             ),
-            label=f"{count} articles",
+            label=label,
             multiline=True,
             withArrow=True,
             openDelay=3,
@@ -231,7 +259,7 @@ class Navbar:
         )
 
     @staticmethod
-    def get_control_btns(total_count):
+    def get_control_btns(total_count, approximate=False):
         start_collection = dmc.ActionIcon(
             DashIconify(icon="uis:process", width=20),
             id="start_collect",
@@ -262,7 +290,7 @@ class Navbar:
             position="top",
         )
 
-        badge = html.Div(Navbar.get_badge(total_count), id="badge")
+        badge = html.Div(Navbar.get_badge(total_count, approximate), id="badge")
         return dmc.Grid(
             [
                 dmc.GridCol(badge, span=4),
@@ -311,17 +339,18 @@ class Navbar:
 
     @staticmethod
     def get_navbar(total_count=None):
-        total_count = total_count or DBConnector.get_total_count(
-            db_manager.engine, DBConnector.TABLE
-        )
-        total_count = total_count if total_count else 0
+        approximate = False
+        if total_count is None:
+            total_count, approximate = DBConnector.get_fast_count(
+                db_manager.engine, DBConnector.TABLE
+            )
 
         date = Navbar.filter_by_date()
         tag = Navbar.filter_by_tag()
         text = Navbar.filter_by_text()
         archives = Navbar.filter_by_archive()
         switches = Navbar.get_switches(total_count)
-        control_btns = Navbar.get_control_btns(total_count)
+        control_btns = Navbar.get_control_btns(total_count, approximate)
 
         drawer_control = dmc.ActionIcon(
             DashIconify(
@@ -400,6 +429,13 @@ class Main:
     @staticmethod
     def get_card(rowid, img_path, title, content, tag, archive, date, link, *args):
         img_height = 200
+        if DeferredImages.is_deferred(img_path):
+            # the placeholder is shown until a backfill worker stores the image
+            if DeferredImages.claim(rowid):
+                image_task.apply_async(
+                    args=(rowid, img_path, date.isoformat(), link, archive)
+                )
+            img_path = None
         if img_path:
             src = resize_image_for_html(img_path, target_height=img_height)
         if img_path is None or src is None:
@@ -0,0 +1,161 @@
+import argparse
+from sqlalchemy import text
+
+from src.utils.logging import logging
+from src.utils.utils import TableCache
+from src.helpers.enum import DBCOLUMNS, PartitionLayouts
+from src.helpers.query_cache import QueryCache
+from src.helpers.db_connector import DBConnector, DBManager
+
+
+logger = logging.getLogger(__name__)
+
+# the generated columns are computed again by the partitioned table
+COLUMNS = ", ".join(
+    col.value
+    for col in DBCOLUMNS
+    if col not in [DBCOLUMNS.hash, DBCOLUMNS.text_searchable]
+)
+RELATIONS = """
+    WITH tree AS (
+        SELECT to_regclass(:table) AS relid
+        UNION SELECT relid FROM pg_partition_tree(to_regclass(:table))
+    )
+    SELECT c.relname, c.relkind FROM pg_class c
+    WHERE c.oid IN (SELECT relid FROM tree)
+    OR c.oid IN (SELECT indexrelid FROM pg_index WHERE indrelid IN (SELECT relid FROM tree))
+    OR c.oid = pg_get_serial_sequence(:table, 'rowid')::regclass
+"""
+ALTER = {"r": "TABLE", "p": "TABLE", "i": "INDEX", "I": "INDEX", "S": "SEQUENCE"}
+
+
+def rename_relations(connection, table, new_table):
+    """Rename the table, its partitions, indexes and sequence to the new prefix."""
+    relations = connection.execute(text(RELATIONS), {"table": table}).fetchall()
+    for name, kind in relations:
+        if name.startswith(table):
+            connection.execute(
+                text(
+                    f"ALTER {ALTER[kind]} {name} "
+                    f"RENAME TO {new_table}{name[len(table):]}"
+                )
+            )
+
+
+def copy_rows(connection, table, target, year=None, after=None):
+    conditions = []
+    if year is not None:
+        conditions.append(
+            f"date >= '{year:04d}-01-01' AND date < '{year + 1:04d}-01-01'"
+        )
+    if after is not None:
+        conditions.append(f"rowid > {int(after)}")
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    result = connection.execute(
+        text(
+            f"INSERT INTO {target} ({COLUMNS}) SELECT {COLUMNS} FROM {table} "
+            f"{where}ON CONFLICT DO NOTHING"
+        )
+    )
+    return result.rowcount
+
+
+def migrate_to_partitions(engine, table, layout):
+    """
+    Move the rows of the monolithic `table` into a new partitioned table,
+    year by year, then swap the two tables. The rows written during the copy
+    are moved while `table` is locked, just before the swap. Updates made to
+    rows already copied are lost, so stop the collectors and backfills first.
+    The old table is kept as `<table>_monolithic` until dropped by hand.
+    """
+    layout = PartitionLayouts(layout)
+    assert layout != PartitionLayouts.none, "Choose a partitioned layout"
+    assert (
+        DBConnector.get_partition_layout(engine, table) == PartitionLayouts.none
+    ), f"{table} is already partitioned"
+
+    DBConnector.add_tag_column(engine, table)
+    target = f"{table}_partitioned"
+    backup = f"{table}_monolithic"
+    assert not DBConnector.has_table(engine, backup), f"{backup} already exists"
+    DBConnector.create_table(engine, target, layout)
+    DBConnector.add_filter_indexes(engine, target)
+
+    with engine.connect() as connection:
+        begin, end = connection.execute(
+            text(
+                "SELECT extract(year FROM min(date))::int, "
+                f"extract(year FROM max(date))::int FROM {table}"
+            )
+        ).one()
+    years = range(begin, end + 1) if begin is not None else []
+    DBConnector.add_partitions(engine, target, years)
+
+    copied = 0
+    for year in years:
+        with engine.begin() as connection:
+            copied += copy_rows(connection, table, target, year)
+        logger.info(f"{year}: {copied} rows were copied into {target}")
+
+    with engine.begin() as connection:
+        connection.execute(text(f"LOCK TABLE {table} IN EXCLUSIVE MODE"))
+        last_rowid = connection.execute(
+            text(f"SELECT coalesce(max(rowid), 0) FROM {target}")
+        ).scalar()
+        new_years = (
+            connection.execute(
+                text(
+                    f"SELECT DISTINCT extract(year FROM date)::int FROM {table} "
+                    "WHERE rowid > :rowid"
+                ),
+                {"rowid": last_rowid},
+            )
+            .scalars()
+            .all()
+        )
+        for year in new_years:
+            for statement in DBConnector.get_partition_statements(target, year, layout):
+                connection.execute(text(statement))
+        copied += copy_rows(connection, table, target, after=last_rowid)
+
+        connection.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{target}', 'rowid'), "
+                f"(SELECT coalesce(max(rowid), 0) + 1 FROM {table}), false)"
+            )
+        )
+        DBConnector.drop_daily_triggers(connection, table)
+        DBConnector.drop_tag_triggers(connection, table)
+        rename_relations(connection, table, backup)
+        rename_relations(connection, target, table)
+        if DBConnector.has_table(connection, DBConnector.get_tags_table(table)):
+            DBConnector.add_tag_triggers(connection, table)
+        if DBConnector.has_table(connection, DBConnector.get_daily_table(table)):
+            DBConnector.add_daily_triggers(connection, table)
+
+    for name in [table, target, backup]:
+        TableCache.invalidate(engine, name)
+        DBConnector.invalidate_partitions(engine, name)
+    QueryCache().bump(table)
+
+    logger.info(
+        f"{copied} rows were moved into the partitioned {table}, "
+        f"the previous table is kept as {backup}"
+    )
+    return copied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-t", "--table", type=str, default=DBConnector.TABLE)
+    parser.add_argument(
+        "-l",
+        "--layout",
+        type=str,
+        default=PartitionLayouts.year.value,
+        choices=[PartitionLayouts.year.value, PartitionLayouts.year_archive.value],
+    )
+    args = parser.parse_args()
+
+    migrate_to_partitions(DBManager().engine, args.table, args.layout)
@@ -0,0 +1,86 @@
+import struct
+import numpy as np
+from enum import Enum
+from io import BytesIO
+from datetime import date
+from pgvector.utils import HalfVector
+
+from src.helpers.enum import DBCOLUMNS
+
+
+class BinaryCopy:
+    """
+    Encode and decode the postgres binary COPY format, so that embeddings are
+    sent and received as halfvec bytes instead of 1024 decimal strings per row.
+    """
+
+    HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+    TRAILER = struct.pack(">h", -1)
+    PG_EPOCH = date(2000, 1, 1).toordinal()
+    NULL = struct.pack(">i", -1)
+
+    COLUMNS = [
+        DBCOLUMNS.date,
+        DBCOLUMNS.archive,
+        DBCOLUMNS.image,
+        DBCOLUMNS.title,
+        DBCOLUMNS.content,
+        DBCOLUMNS.tag,
+        DBCOLUMNS.link,
+        DBCOLUMNS.embedding,
+    ]
+
+    @staticmethod
+    def _encode_text(value):
+        value = value.value if isinstance(value, Enum) else value
+        encoded = str(value).encode("utf-8")
+        return struct.pack(">i", len(encoded)) + encoded
+
+    @staticmethod
+    def _encode_date(value):
+        return struct.pack(">ii", 4, value.toordinal() - BinaryCopy.PG_EPOCH)
+
+    @staticmethod
+    def _encode_halfvec(value):
+        encoded = HalfVector(np.ravel(value)).to_binary()
+        return struct.pack(">i", len(encoded)) + encoded
+
+    @staticmethod
+    def encode_rows(rows):
+        encoders = {
+            DBCOLUMNS.date: BinaryCopy._encode_date,
+            DBCOLUMNS.embedding: BinaryCopy._encode_halfvec,
+        }
+        buffer = BytesIO()
+        buffer.write(BinaryCopy.HEADER)
+        field_count = struct.pack(">h", len(BinaryCopy.COLUMNS))
+        for row in rows:
+            buffer.write(field_count)
+            for column in BinaryCopy.COLUMNS:
+                value = row.get(column)
+                if value is None:
+                    buffer.write(BinaryCopy.NULL)
+                else:
+                    encode = encoders.get(column, BinaryCopy._encode_text)
+                    buffer.write(encode(value))
+        buffer.write(BinaryCopy.TRAILER)
+        buffer.seek(0)
+        return buffer
+
+    @staticmethod
+    def decode_embeddings(buffer, dim):
+        """Decode the output of `COPY (SELECT rowid, embedding ...) TO STDOUT`."""
+        dtype = np.dtype(
+            [
+                ("field_count", ">i2"),
+                ("rowid_length", ">i4"),
+                ("rowid", ">i8"),
+                ("embedding_length", ">i4"),
+                ("dim", ">u2"),
+                ("unused", ">u2"),
+                ("embedding", ">f2", (dim,)),
+            ]
+        )
+        body = buffer[len(BinaryCopy.HEADER) : len(buffer) - len(BinaryCopy.TRAILER)]
+        rows = np.frombuffer(body, dtype=dtype)
+        return rows["rowid"].astype(np.int64), rows["embedding"].astype(np.float16)
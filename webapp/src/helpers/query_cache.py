@@ -0,0 +1,203 @@
+import os
+import pickle
+import orjson
+import hashlib
+import logging
+import unicodedata
+import numpy as np
+from enum import Enum
+from functools import wraps
+from datetime import date, datetime
+from sqlalchemy.util import LRUCache
+
+from src.helpers.enum import ResultModes
+from src.helpers.redis_manager import RedisManager
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCache:
+    """
+    Redis cache of the results of the DBConnector read methods.
+
+    The key is a hash of the method, table and arguments, prefixed by a
+    generation counter of the table. Every write to the table bumps the
+    counter, so the results cached before are never read again and expire
+    with their TTL. The backfills updating one row at a time bump it once
+    they are done.
+    """
+
+    PREFIX = "qcache"
+    MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", 1 << 20))
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(QueryCache, cls).__new__(cls)
+        return cls._instance
+
+    @property
+    def enabled(self):
+        return (
+            os.getenv("QUERY_CACHE", "true").lower() == "true"
+            and os.getenv("REDIS_URL") is not None
+        )
+
+    @property
+    def client(self):
+        return RedisManager().client
+
+    @staticmethod
+    def canonical(value):
+        """Convert the arguments to a JSON value that does not depend on ordering."""
+        if isinstance(value, Enum):
+            return value.value
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        if isinstance(value, np.ndarray):
+            return hashlib.sha1(value.tobytes()).hexdigest()
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, dict):
+            items = [
+                (str(QueryCache.canonical(key)), QueryCache.canonical(item))
+                for key, item in value.items()
+            ]
+            return dict(sorted(items))
+        if isinstance(value, (list, tuple, set)):
+            return [QueryCache.canonical(item) for item in value]
+        return value
+
+    def _generation_key(self, table):
+        return f"{self.PREFIX}:{table}:generation"
+
+    def get_key(self, table, method, args, kwargs):
+        generation = self.client.get(self._generation_key(table)) or b"0"
+        arguments = orjson.dumps(
+            self.canonical([args, kwargs]), option=orjson.OPT_SORT_KEYS
+        )
+        digest = hashlib.sha256(arguments).hexdigest()
+        return f"{self.PREFIX}:{table}:{generation.decode()}:{method}:{digest}"
+
+    def get(self, key):
+        value = self.client.get(key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, ttl):
+        value = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(value) <= self.MAX_BYTES:
+            self.client.set(key, value, ex=ttl)
+
+    def bump(self, table):
+        if not self.enabled:
+            return
+        try:
+            self.client.incr(self._generation_key(table))
+        except Exception as e:
+            logger.warning(f"Failed to invalidate the cached results of {table}: {e}")
+
+
+def cached(ttl, with_mode=True):
+    """
+    Cache the results of a read method decorated with `execute` for `ttl`
+    seconds. Without `with_mode`, the method runs its own queries and is
+    called without the `result_mode`.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(engine, table, *args, result_mode=ResultModes.rows, **kwargs):
+            options = {"result_mode": result_mode} if with_mode else {}
+            cache = QueryCache()
+            if not cache.enabled or result_mode == ResultModes.stream:
+                return func(engine, table, *args, **options, **kwargs)
+
+            try:
+                key = cache.get_key(
+                    table, func.__name__, args, {**kwargs, "result_mode": result_mode}
+                )
+                result = cache.get(key)
+            except Exception as e:
+                logger.warning(f"Failed to read the query cache: {e}")
+                return func(engine, table, *args, **options, **kwargs)
+
+            if result is None:
+                result = func(engine, table, *args, **options, **kwargs)
+                if result is not None:
+                    try:
+                        cache.set(key, result, ttl)
+                    except Exception as e:
+                        logger.warning(f"Failed to write the query cache: {e}")
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+class EmbeddingCache:
+    """
+    Two level cache of the query embeddings: a LRU in the process, then redis
+    so that all the workers share the embeddings. The key is the normalized
+    query and the embedding model, since a search triggers several callbacks
+    embedding the same query.
+    """
+
+    PREFIX = "qembed"
+    MODEL = os.getenv("EMBED_MODEL", "jinaai/jina-embeddings-v3")
+    TTL = int(os.getenv("EMBEDDING_CACHE_TTL", 30 * 24 * 3600))
+    _local = LRUCache(1000)
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(EmbeddingCache, cls).__new__(cls)
+        return cls._instance
+
+    @property
+    def client(self):
+        return RedisManager().client
+
+    @staticmethod
+    def normalize(query):
+        return " ".join(unicodedata.normalize("NFKC", query).split())
+
+    def get_key(self, query):
+        key = f"{self.MODEL}\n{self.normalize(query)}".encode("utf-8")
+        return f"{self.PREFIX}:{hashlib.sha256(key).hexdigest()}"
+
+    def get(self, query):
+        key = self.get_key(query)
+        embedding = self._local.get(key)
+        if embedding is not None or os.getenv("REDIS_URL") is None:
+            return embedding
+
+        try:
+            value = self.client.get(key)
+        except Exception as e:
+            logger.warning(f"Failed to read the embedding cache: {e}")
+            return None
+        if value is None:
+            return None
+
+        embedding = np.frombuffer(value, dtype=np.float32).tolist()
+        self._local[key] = embedding
+        return embedding
+
+    def set(self, query, embedding):
+        """
+        Cache the embedding as float32, and return it with that precision so a
+        query gives the same vector whether it was cached or not.
+        """
+        key = self.get_key(query)
+        value = np.asarray(embedding, dtype=np.float32)
+        embedding = value.tolist()
+        self._local[key] = embedding
+        if os.getenv("REDIS_URL") is None:
+            return embedding
+
+        try:
+            self.client.set(key, value.tobytes(), ex=self.TTL)
+        except Exception as e:
+            logger.warning(f"Failed to write the embedding cache: {e}")
+        return embedding
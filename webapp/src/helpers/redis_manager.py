@@ -0,0 +1,31 @@
+import os
+import redis
+
+
+class RedisManager:
+    _client = None
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(RedisManager, cls).__new__(cls)
+        return cls._instance
+
+    @property
+    def client(self):
+        """Get the singleton redis client"""
+        if self._client is None:
+            self._client = self._create_client()
+        return self._client
+
+    @staticmethod
+    def _create_client():
+        redis_url = os.getenv("REDIS_URL")
+        assert redis_url is not None, "Failed to load the env variables"
+
+        return redis.Redis.from_url(
+            redis_url,
+            socket_timeout=10,
+            socket_connect_timeout=10,
+            health_check_interval=30,
+        )
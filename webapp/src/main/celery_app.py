@@ -1,5 +1,8 @@
 import os
 from celery import Celery
+from kombu import Queue
+
+from src.helpers.enum import CeleryTasks, CeleryQueues
 
 celery_app = Celery(
     __name__,
@@ -18,7 +21,26 @@ celery_app.conf.update(
     worker_prefetch_multiplier=1,  # Process one task at a time
     task_acks_late=True,  # Acknowledge task after completion
     task_time_limit=None,  # No time limit
-    broker_transport_options={"visibility_timeout": 43200},
+    broker_transport_options={
+        "visibility_timeout": 43200,
+        "priority_steps": list(range(10)),
+        "queue_order_strategy": "priority",
+    },
+    # Each queue is consumed by its own worker profile (see docker-compose.yaml):
+    # prefork for the parsing and the exports, threads for the I/O bound
+    # backfills and the Dash background callbacks, which use the default queue
+    task_queues=[Queue(queue.value) for queue in CeleryQueues],
+    task_default_queue=CeleryQueues.ui.value,
+    task_routes={
+        CeleryTasks.collect.value: {"queue": CeleryQueues.collect.value},
+        CeleryTasks.collect_chunk.value: {"queue": CeleryQueues.collect.value},
+        CeleryTasks.prepare_collect.value: {"queue": CeleryQueues.collect.value},
+        CeleryTasks.download.value: {"queue": CeleryQueues.download.value},
+        CeleryTasks.images.value: {"queue": CeleryQueues.backfill.value},
+        CeleryTasks.image.value: {"queue": CeleryQueues.backfill.value},
+        CeleryTasks.embeddings.value: {"queue": CeleryQueues.backfill.value},
+        CeleryTasks.details.value: {"queue": CeleryQueues.backfill.value},
+    },
     worker_hijack_root_logger=False,
     worker_redirect_stdouts=True,
     worker_redirect_stdouts_level="DEBUG",
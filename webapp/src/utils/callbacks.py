@@ -8,8 +8,13 @@ from dash_extensions.enrich import Input, State, Output, callback
 from src.utils.utils import get_query_embedding
 from src.helpers.layout import Layout, Navbar, Main
 from src.helpers.db_connector import DBConnector, DBManager
-from src.helpers.enum import DBCOLUMNS, OPERATORS, CeleryTasks, JobsKeys
-from src.utils.celery_tasks import collection_task, revoke_task, download_task
+from src.helpers.enum import DBCOLUMNS, OPERATORS, CeleryTasks, JobsKeys, ResultModes
+from src.utils.celery_tasks import (
+    collection_task,
+    revoke_task,
+    download_task,
+    start_collection_job,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -22,7 +27,7 @@ def get_filters_dict(archive, tag, date_range, submit, null_clicks, query):
     if date_range[1]:
         filters[DBCOLUMNS.date].append((OPERATORS.le, date_range[1]))
 
-    filters.update({DBCOLUMNS.tag: [(OPERATORS.like, tag.strip())]} if tag else {})
+    filters.update({DBCOLUMNS.tag_id: [(OPERATORS.eq, int(tag))]} if tag else {})
 
     filters.update({DBCOLUMNS.archive: [(OPERATORS.in_, archive)]} if archive else {})
 
@@ -38,7 +43,20 @@ def get_filters_dict(archive, tag, date_range, submit, null_clicks, query):
         if null_clicks is not None and null_clicks % 2
         else {}
     )
-    return filters
+    return DBConnector.get_hybrid_filters(db_manager.engine, DBConnector.TABLE, filters)
+
+
+def get_histogram(groupby, filters):
+    df = DBConnector.group_by(
+        db_manager.engine,
+        DBConnector.TABLE,
+        groupby,
+        filters,
+        result_mode=ResultModes.frame,
+    )
+    if df is None:
+        return pd.DataFrame(columns=["date", "count"])
+    return df.set_axis(["date", "count"], axis=1)
 
 
 @callback(
@@ -60,7 +78,9 @@ def get_filters_dict(archive, tag, date_range, submit, null_clicks, query):
 def create_content(
     archive, tag, date_range, submit, sort_clicks, null_clicks, n, query, groupby
 ):
-    filters = get_filters_dict(archive, tag, date_range, submit, null_clicks, query)
+    filters, vector_path = get_filters_dict(
+        archive, tag, date_range, submit, null_clicks, query
+    )
 
     order = sort_clicks is None or not sort_clicks % 2
     states = {
@@ -92,20 +112,14 @@ def create_content(
         desc_order=order,
     )
     args = args if args else []
-    total_count = DBConnector.get_total_count(
+    total_count, approximate = DBConnector.get_fast_count(
         db_manager.engine, DBConnector.TABLE, filters
     )
-    total_count = total_count if total_count else 0
 
-    badge = Navbar.get_badge(total_count)
+    badge = Navbar.get_badge(total_count, approximate, vector_path)
     if len(args) > Layout.SLIDES:
 
-        df = pd.DataFrame(
-            DBConnector.group_by(
-                db_manager.engine, DBConnector.TABLE, groupby, filters
-            ),
-            columns=["date", "count"],
-        )
+        df = get_histogram(groupby, filters)
         last_seen = {
             "forward": {
                 DBCOLUMNS.date: args[-1][-2],
@@ -138,7 +152,9 @@ def update_carousel(active, previous_active, last_seen, states):
         order = states["order"]
         null_clicks = states["null_clicks"]
 
-        filters = get_filters_dict(archive, tag, date_range, True, null_clicks, query)
+        filters, _ = get_filters_dict(
+            archive, tag, date_range, True, null_clicks, query
+        )
 
         direction = "forward" if active > previous_active else "backward"
         direction = direction if active != previous_active else "no_change"
@@ -188,6 +204,16 @@ def update_carousel(active, previous_active, last_seen, states):
     raise PreventUpdate
 
 
+@callback(
+    Output("tag", "data"),
+    Input("tag", "searchValue"),
+    State("tag", "value"),
+    prevent_initial_call=True,
+)
+def search_tags(search_value, tag):
+    return Navbar.get_tag_options(search_value, tag)
+
+
 @callback(
     Output("drawer", "opened"),
     Output("open_drawer", "style"),
@@ -228,12 +254,11 @@ def group_by(value, states):
         order = states["order"]
         null_clicks = states["null_clicks"]
 
-        filters = get_filters_dict(archive, tag, date_range, True, null_clicks, query)
-
-        df = pd.DataFrame(
-            DBConnector.group_by(db_manager.engine, DBConnector.TABLE, value, filters),
-            columns=["date", "count"],
+        filters, _ = get_filters_dict(
+            archive, tag, date_range, True, null_clicks, query
         )
+
+        df = get_histogram(value, filters)
         return Main.get_stats(df, not order), False
     raise PreventUpdate
 
@@ -255,7 +280,9 @@ def trigger_download(n_clicks, states):
         null_clicks = states["null_clicks"]
         order = states["order"]
 
-        filters = get_filters_dict(archive, tag, date_range, True, null_clicks, query)
+        filters, _ = get_filters_dict(
+            archive, tag, date_range, True, null_clicks, query
+        )
 
         columns = [
             DBCOLUMNS.rowid,
@@ -320,11 +347,10 @@ def start_collection(n_clicks, states):
         archive = states.get("archive")
 
         try:
-            task = collection_task.apply_async(
-                args=(archive, date_range[0], date_range[1])
-            )
+            task = start_collection_job(archive, date_range[0], date_range[1])
             job_status = {
                 JobsKeys.TASKID: task.id,
+                JobsKeys.GROUPID: task.parent.id,
                 JobsKeys.STATUS: "start",
                 JobsKeys.TASKNAME: CeleryTasks.collect,
             }
@@ -345,7 +371,7 @@ def stop_collection(n_clicks, job_status):
     if n_clicks:
         status = job_status.copy()
         task_id = status[JobsKeys.TASKID]
-        revoke_task(task_id)
+        revoke_task(task_id, status.get(JobsKeys.GROUPID))
         status[JobsKeys.STATUS] = "STOP"
         return status
     raise PreventUpdate
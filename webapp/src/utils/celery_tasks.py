@@ -1,33 +1,132 @@
 import os
 import zipfile
 import logging
-import pandas as pd
 from io import StringIO
+from celery import chain, chord
+from datetime import date, timedelta
+from celery.result import GroupResult
 
 from src.main.celery_app import celery_app
 from src.helpers.db_connector import DBConnector, DBManager
-from src.helpers.enum import DBCOLUMNS, CeleryTasks, JobsKeys
+from src.helpers.enum import DBCOLUMNS, OPERATORS, CeleryTasks, JobsKeys, ResultModes
+from src.data_scrapping.data_collector import DataCollector
 from src.data_scrapping.collectors_agg import CollectorsAggregator
+from src.data_scrapping.collectors_registry import Registry
+from src.data_scrapping.deferred_images import DeferredImages
+from src.data_scrapping.deferred_embeddings import DeferredEmbeddings
+from src.data_scrapping.deferred_details import DeferredDetails
 
 
 logger = logging.getLogger(__name__)
 db_manager = DBManager()
 
+# with the redis broker, 0 is the highest priority and 9 the lowest
+IMAGES_PRIORITY = 9
+COLLECT_CHUNK_DAYS = int(os.getenv("COLLECT_CHUNK_DAYS", 30))
+
+
+def get_flag(value, env_variable):
+    if value is not None:
+        return value
+    return os.getenv(env_variable, "false").lower() == "true"
+
+
+def split_date_range(begin_date, end_date, chunk_days=COLLECT_CHUNK_DAYS):
+    """Split the range into chunks of `chunk_days`, newest first."""
+    begin_date = DataCollector.convert_to_date(begin_date)
+    end_date = DataCollector.convert_to_date(end_date)
+
+    chunks = []
+    chunk_end = end_date
+    while chunk_end >= begin_date:
+        chunk_begin = max(begin_date, chunk_end - timedelta(days=chunk_days - 1))
+        chunks.append(
+            (chunk_begin.strftime("%d-%m-%Y"), chunk_end.strftime("%d-%m-%Y"))
+        )
+        chunk_end = chunk_begin - timedelta(days=1)
+    return chunks
+
+
+def start_collection_job(
+    archive, begin_date, end_date, defer_images=None, listing_only=None
+):
+    """
+    Run the collection as one subtask per archive and date chunk, so it can
+    be spread over several workers. The chunks are idempotent: done dates are
+    skipped through the crawl state and duplicates are ignored at insert.
+    `prepare_collection_task` sets the tables up before the chunks start, and
+    `collection_task` runs once all the chunks are finished.
+    """
+    names = archive if archive else Registry.list_registered()
+    chunks = [
+        collect_chunk_task.s(name, chunk_begin, chunk_end, defer_images, listing_only)
+        for chunk_begin, chunk_end in split_date_range(begin_date, end_date)
+        for name in names
+    ]
+    result = chain(
+        prepare_collection_task.si(names),
+        chord(
+            chunks,
+            collection_task.s(
+                archive, begin_date, end_date, defer_images, listing_only
+            ),
+        ),
+    ).apply_async()
+    result.parent.save()
+    return result
+
+
+@celery_app.task(name=CeleryTasks.prepare_collect, bind=False)
+def prepare_collection_task(names):
+    CollectorsAggregator.prepare(names)
+
+
+@celery_app.task(
+    name=CeleryTasks.collect_chunk,
+    bind=False,
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=3,
+)
+def collect_chunk_task(
+    archive, begin_date, end_date, defer_images=None, listing_only=None
+):
+    collector = CollectorsAggregator(
+        [archive],
+        begin_date=begin_date,
+        end_date=end_date,
+        timeout=10,
+        defer_images=defer_images,
+        listing_only=listing_only,
+    )
+    return collector.run()
+
 
 @celery_app.task(name=CeleryTasks.collect, bind=False)
-def collection_task(archive, begin_date, end_date):
-    try:
-        collector = CollectorsAggregator(
-            archive,
-            begin_date=begin_date,
-            end_date=end_date,
-            timeout=10,
+def collection_task(
+    results, archive, begin_date, end_date, defer_images=None, listing_only=None
+):
+    collected = {}
+    for result in results:
+        for name, count in (result or {}).items():
+            collected[name] = collected.get(name, 0) + count
+    logger.info(f"Collection finished: {collected}")
+
+    # rows inserted while the embedding service was down
+    if sum(collected.values()):
+        embeddings_task.apply_async(args=(archive, begin_date, end_date))
+
+    if get_flag(listing_only, "LISTING_ONLY"):
+        details_task.apply_async(
+            args=(archive, begin_date, end_date), priority=IMAGES_PRIORITY
+        )
+
+    if get_flag(defer_images, "DEFER_IMAGES"):
+        images_task.apply_async(
+            args=(archive, begin_date, end_date), priority=IMAGES_PRIORITY
         )
-        collector.run()
 
-        return {JobsKeys.STATUS: "completed", "result": "Task Completed!"}
-    except Exception as e:
-        raise ValueError(f"Task failed: {str(e)}")
+    return {JobsKeys.STATUS: "completed", "result": collected}
 
 
 @celery_app.task(name=CeleryTasks.download, bind=False)
@@ -41,7 +140,7 @@ def download_task(columns, filters, order):
     with zipfile.ZipFile(zip_path, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
         last_seen = None
         while True:
-            args = DBConnector.fetch_data_keyset(
+            df = DBConnector.fetch_data_keyset(
                 db_manager.engine,
                 DBConnector.TABLE,
                 last_seen_value=last_seen,
@@ -49,15 +148,15 @@ def download_task(columns, filters, order):
                 filters=filters,
                 columns=columns,
                 desc_order=order,
+                result_mode=ResultModes.frame,
             )
 
-            if args is None or len(args) == 0:
+            if df is None or df.empty:
                 break
             last_seen = {
-                DBCOLUMNS.date: args[-1][1],
-                DBCOLUMNS.rowid: args[-1][0],
+                DBCOLUMNS.date: df[DBCOLUMNS.date].iloc[-1],
+                DBCOLUMNS.rowid: int(df[DBCOLUMNS.rowid].iloc[-1]),
             }
-            df = pd.DataFrame(args, columns=columns)
             csv_buffer = StringIO()
             df.to_csv(csv_buffer, index=False)
             zf.writestr(f"data_chunk_{chunk_index:03d}.csv", csv_buffer.getvalue())
@@ -66,5 +165,47 @@ def download_task(columns, filters, order):
     return zip_path
 
 
-def revoke_task(task_id):
+def get_job_filters(archive, begin_date, end_date):
+    filters = {DBCOLUMNS.archive: [(OPERATORS.in_, archive)]} if archive else {}
+    if begin_date:
+        filters[DBCOLUMNS.date] = [(OPERATORS.ge, begin_date)]
+    if end_date:
+        filters.setdefault(DBCOLUMNS.date, []).append((OPERATORS.le, end_date))
+    return filters
+
+
+@celery_app.task(name=CeleryTasks.images, bind=False)
+def images_task(archive, begin_date, end_date):
+    filters = get_job_filters(archive, begin_date, end_date)
+    fetched = DeferredImages.backfill(filters)
+    return {JobsKeys.STATUS: "completed", "result": f"{fetched} images fetched"}
+
+
+@celery_app.task(name=CeleryTasks.image, bind=False)
+def image_task(rowid, image_url, image_date, link, archive=None):
+    """Image of a card shown before the backfill reached it."""
+    DeferredImages.fetch(
+        rowid, image_url, date.fromisoformat(image_date), link, archive
+    )
+
+
+@celery_app.task(name=CeleryTasks.details, bind=False)
+def details_task(archive, begin_date, end_date):
+    filters = get_job_filters(archive, begin_date, end_date)
+    enriched = DeferredDetails.backfill(filters)
+    return {JobsKeys.STATUS: "completed", "result": f"{enriched} articles enriched"}
+
+
+@celery_app.task(name=CeleryTasks.embeddings, bind=False)
+def embeddings_task(archive, begin_date, end_date):
+    filters = get_job_filters(archive, begin_date, end_date)
+    updated = DeferredEmbeddings.backfill(filters)
+    return {JobsKeys.STATUS: "completed", "result": f"{updated} embeddings computed"}
+
+
+def revoke_task(task_id, group_id=None):
+    if group_id:
+        group = GroupResult.restore(group_id, app=celery_app)
+        if group is not None:
+            group.revoke(terminate=True, signal="SIGKILL")
     celery_app.control.revoke(task_id, terminate=True, signal="SIGKILL")
@@ -1,3 +1,4 @@
+import os
 import logging.config
 
 LOGGING_CONFIG = {
@@ -25,6 +26,8 @@ LOGGING_CONFIG = {
     },
     "root": {"level": "DEBUG", "handlers": ["console", "file"]},
     "loggers": {
+        # set SQL_LOG_LEVEL=DEBUG to log the queries run by DBConnector
+        "src.sql": {"level": os.getenv("SQL_LOG_LEVEL", "INFO")},
         "uvicorn": {"level": "WARNING", "handlers": [], "propagate": False},
         "uvicorn.error": {"level": "WARNING", "handlers": [], "propagate": False},
         "uvicorn.access": {"level": "WARNING", "handlers": [], "propagate": False},
@@ -6,26 +6,131 @@ import hashlib
 import logging
 import requests
 import itertools
+import threading
 import numpy as np
+import pandas as pd
 from functools import wraps
 from wand.image import Image as WandImage
-from sqlalchemy import inspect, MetaData, Table, text
+from sqlalchemy import MetaData, Table, Select, text
+from sqlalchemy.util import LRUCache
+from sqlalchemy.exc import DBAPIError, NoSuchTableError
 
-from src.helpers.enum import DBCOLUMNS
+from src.helpers.enum import DBCOLUMNS, ResultModes
+from src.helpers.image_store import ImageStore
+from src.helpers.query_cache import QueryCache, EmbeddingCache
 
 logger = logging.getLogger(__name__)
+sql_logger = logging.getLogger("src.sql")
 
+# Compiled selects built by DBConnector (keyset page, count, group_by...).
+# They are kept apart from the engine cache so that insert batches,
+# which compile to a new statement for every batch size, don't evict them.
+STATEMENT_CACHE = LRUCache(500)
+STREAM_FETCH_SIZE = int(os.getenv("STREAM_FETCH_SIZE", 50_000))
 
-def alternate_elements(list_of_list):
-    pad_token = ("to_delete", "to_delete")
-    padded = np.array(
-        list(zip(*itertools.zip_longest(*list_of_list, fillvalue=pad_token)))
-    )
-    col_1 = padded[..., 0].T.flatten()
-    col_2 = padded[..., 1].T.flatten()
-    col_1 = col_1[np.where(col_1 != pad_token[0])]
-    col_2 = col_2[np.where(col_2 != pad_token[1])]
-    return list(zip(col_1, col_2))
+
+def round_robin(*iterables):
+    """Lazily take one element of each iterable in turn until all are exhausted."""
+    iterators = itertools.cycle(iter(iterable) for iterable in iterables)
+    active = len(iterables)
+    while active:
+        try:
+            for iterator in iterators:
+                yield next(iterator)
+        except StopIteration:
+            active -= 1
+            iterators = itertools.cycle(itertools.islice(iterators, active))
+
+
+def _rot(x, k):
+    return ((x << k) | (x >> (32 - k))) & 0xFFFFFFFF
+
+
+def _mix(a, b, c):
+    a = (a - c) & 0xFFFFFFFF
+    a ^= _rot(c, 4)
+    c = (c + b) & 0xFFFFFFFF
+    b = (b - a) & 0xFFFFFFFF
+    b ^= _rot(a, 6)
+    a = (a + c) & 0xFFFFFFFF
+    c = (c - b) & 0xFFFFFFFF
+    c ^= _rot(b, 8)
+    b = (b + a) & 0xFFFFFFFF
+    a = (a - c) & 0xFFFFFFFF
+    a ^= _rot(c, 16)
+    c = (c + b) & 0xFFFFFFFF
+    b = (b - a) & 0xFFFFFFFF
+    b ^= _rot(a, 19)
+    a = (a + c) & 0xFFFFFFFF
+    c = (c - b) & 0xFFFFFFFF
+    c ^= _rot(b, 4)
+    b = (b + a) & 0xFFFFFFFF
+    return a, b, c
+
+
+def _final(a, b, c):
+    c ^= b
+    c = (c - _rot(b, 14)) & 0xFFFFFFFF
+    a ^= c
+    a = (a - _rot(c, 11)) & 0xFFFFFFFF
+    b ^= a
+    b = (b - _rot(a, 25)) & 0xFFFFFFFF
+    c ^= b
+    c = (c - _rot(b, 16)) & 0xFFFFFFFF
+    a ^= c
+    a = (a - _rot(c, 4)) & 0xFFFFFFFF
+    b ^= a
+    b = (b - _rot(a, 14)) & 0xFFFFFFFF
+    c ^= b
+    c = (c - _rot(b, 24)) & 0xFFFFFFFF
+    return c
+
+
+def pg_hashtext(value):
+    """
+    Python port of postgres `hashtext` (hash_bytes in src/common/hashfn.c on a
+    little endian server), to compute the `hash` column of a link client side.
+    """
+    key = value.encode("utf-8")
+    length = len(key)
+    a = b = c = (0x9E3779B9 + length + 3923095) & 0xFFFFFFFF
+
+    offset = 0
+    while length - offset >= 12:
+        a = (a + int.from_bytes(key[offset : offset + 4], "little")) & 0xFFFFFFFF
+        b = (b + int.from_bytes(key[offset + 4 : offset + 8], "little")) & 0xFFFFFFFF
+        c = (c + int.from_bytes(key[offset + 8 : offset + 12], "little")) & 0xFFFFFFFF
+        a, b, c = _mix(a, b, c)
+        offset += 12
+
+    tail = key[offset:]
+    # the lowest byte of c is reserved for the length
+    a = (a + int.from_bytes(tail[0:4], "little")) & 0xFFFFFFFF
+    b = (b + int.from_bytes(tail[4:8], "little")) & 0xFFFFFFFF
+    c = (c + (int.from_bytes(tail[8:11], "little") << 8)) & 0xFFFFFFFF
+
+    c = _final(a, b, c)
+    return c - (1 << 32) if c >= (1 << 31) else c
+
+
+def reciprocal_rank_fusion(rankings, weights, limit, k=60):
+    """
+    Fuse the ranked ids of each leg, best first, into `limit` ids sorted by
+    their weighted reciprocal rank score `sum(weight / (k + rank))`.
+    """
+    ids = [np.asarray(ranking, dtype=np.int64) for ranking in rankings]
+    contributions = [
+        weight / (k + np.arange(1, len(ranking) + 1))
+        for ranking, weight in zip(ids, weights)
+    ]
+    if not sum(len(ranking) for ranking in ids):
+        return [], []
+
+    unique, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+    scores = np.bincount(inverse, weights=np.concatenate(contributions))
+    # stable, so that ties keep the smallest id first
+    order = np.argsort(-scores, kind="stable")[:limit]
+    return unique[order].tolist(), scores[order].tolist()
 
 
 def resize_image_for_html(img_path, target_height=300):
@@ -34,7 +139,11 @@ def resize_image_for_html(img_path, target_height=300):
     images were encoded in an unsupported format by those libraries.
     """
     try:
-        with WandImage(filename=img_path) as img:
+        image_bytes = ImageStore().read(img_path)
+        if image_bytes is None:
+            return None
+
+        with WandImage(blob=image_bytes) as img:
             aspect_ratio = img.width / img.height
             new_width = int(target_height * aspect_ratio)
             img.resize(new_width, target_height)
@@ -54,11 +163,11 @@ def save_image(file_path, image_bytes, quality=80):
             with WandImage(blob=image_bytes) as img:
                 img.quality = quality
                 img.format = "webp"
-                img.save(filename=file_path)
+                image_bytes = img.make_blob()
         except Exception:
-            with open(file_path, "wb") as file:
-                file.write(image_bytes)
+            pass
         finally:
+            ImageStore().write(file_path, image_bytes)
             return file_path
 
 
@@ -72,9 +181,9 @@ def get_image_path(data_dir, date, section_url):
         month = "unknown"
 
     subdir = os.path.join(data_dir, str(year), str(month))
-    os.makedirs(subdir, exist_ok=True)
     file_name = f"{hash_url}.webp"
     file_path = os.path.join(subdir, file_name)
+    ImageStore().prepare(file_path)
     return file_path
 
 
@@ -92,58 +201,168 @@ def convert_count_to_str(count):
     return count
 
 
+class TableCache:
+    """
+    Process wide cache of the tables reflected by `execute`.
+    Only existing tables are cached, so a table created by another process
+    is picked up on the next call. `create_table` and `drop_table` invalidate it.
+    """
+
+    _tables = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, engine, table):
+        key = (str(engine.url), table)
+        table_ref = cls._tables.get(key)
+        if table_ref is None:
+            with cls._lock:
+                table_ref = cls._tables.get(key)
+                if table_ref is None:
+                    try:
+                        table_ref = Table(table, MetaData(), autoload_with=engine)
+                    except NoSuchTableError:
+                        return None
+                    cls._tables[key] = table_ref
+        return table_ref
+
+    @classmethod
+    def invalidate(cls, engine, table):
+        with cls._lock:
+            cls._tables.pop((str(engine.url), table), None)
+
+
+def has_debug_sink(logger):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return False
+
+    current = logger
+    while current is not None:
+        if any(handler.level <= logging.DEBUG for handler in current.handlers):
+            return True
+        current = current.parent if current.propagate else None
+    return False
+
+
+def render_query(query, engine):
+    query_str = str(
+        query.compile(
+            engine,
+            compile_kwargs={"literal_binds": True},
+        )
+    )
+    pattern = r"\[\s*[\d\.\-eE+, \s]+\s*\]"
+    return re.sub(pattern, ":'query_vector'::halfvec", query_str)
+
+
+def run_query(connection, engine, table, table_ref, func, args, kwargs, **options):
+    ef_search = os.getenv("HNSW_EF_SEARCH", 1000)
+    connection.execute(
+        text(
+            "SELECT set_config('hnsw.ef_search', :ef_val, true), "
+            "set_config('hnsw.iterative_scan', 'relaxed_order', true)"
+        ),
+        {"ef_val": str(ef_search)},
+    )
+    query = func(table_ref, *args, **kwargs)
+    if has_debug_sink(sql_logger):
+        query_str = render_query(query, engine)
+        sql_logger.debug(f"{func.__name__}: {query_str}\n{'*'.join(['*']*50)}")
+
+    execution_options = dict(options)
+    if isinstance(query, Select):
+        execution_options["compiled_cache"] = STATEMENT_CACHE
+    try:
+        return connection.execute(query, execution_options=execution_options)
+    except DBAPIError:
+        # the cached table may be stale if the schema changed elsewhere
+        TableCache.invalidate(engine, table)
+        raise
+
+
+def stream_results(engine, table, table_ref, func, fetch_size, args, kwargs):
+    """
+    Yield the rows in batches of `fetch_size` from a server side cursor.
+    The cursor lives in a single transaction that stays open until the generator
+    is exhausted or closed, which keeps it valid with pgbouncer transaction pooling.
+    """
+    with engine.connect() as connection:
+        with connection.begin():
+            result = run_query(
+                connection,
+                engine,
+                table,
+                table_ref,
+                func,
+                args,
+                kwargs,
+                stream_results=True,
+                max_row_buffer=fetch_size,
+            )
+            single_column = len(result.keys()) == 1
+            for partition in result.partitions(fetch_size):
+                if single_column:
+                    yield [row[0] for row in partition]
+                else:
+                    yield [list(row) for row in partition]
+
+
 def execute(func):
     @wraps(func)
-    def wrapper(engine, table, *args, **kwargs):
-        ef_search = os.getenv("HNSW_EF_SEARCH", 1000)
-        inspector = inspect(engine)
-        if table not in inspector.get_table_names():
+    def wrapper(
+        engine,
+        table,
+        *args,
+        result_mode=ResultModes.rows,
+        fetch_size=STREAM_FETCH_SIZE,
+        bump=True,
+        **kwargs,
+    ):
+        table_ref = TableCache.get(engine, table)
+        if table_ref is None:
             return None
 
-        metadata = MetaData()
-        table_ref = Table(table, metadata, autoload_with=engine)
+        if result_mode == ResultModes.stream:
+            return stream_results(
+                engine, table, table_ref, func, fetch_size, args, kwargs
+            )
 
         with engine.connect() as connection:
             with connection.begin():
-                connection.execute(
-                    text("SET LOCAL hnsw.ef_search = :ef_val"), {"ef_val": ef_search}
-                )
-                connection.execute(
-                    text("SET LOCAL hnsw.iterative_scan = relaxed_order")
+                result = run_query(
+                    connection, engine, table, table_ref, func, args, kwargs
                 )
-                query = func(table_ref, *args, **kwargs)
-                query_str = str(
-                    query.compile(
-                        engine,
-                        compile_kwargs={"literal_binds": True},
-                    )
-                )
-                pattern = r"\[\s*[\d\.\-eE+, \s]+\s*\]"
-                query_str = re.sub(pattern, ":'query_vector'::halfvec", query_str)
-                logger.debug(f"{func.__name__}: {query_str}\n{'*'.join(['*']*50)}")
-                result = connection.execute(query)
                 if result.returns_rows:
-                    rows = result.fetchall()
-                    rows = clean_fetched_values(rows)
-                    return rows
-                else:
-                    return result.rowcount
+                    return fetch_results(result, result_mode)
+                rowcount = result.rowcount
+
+        if rowcount and bump:
+            # once committed, the cached results of the table are outdated
+            QueryCache().bump(table)
+        return rowcount
 
     return wrapper
 
 
+def fetch_results(result, result_mode):
+    if result_mode == ResultModes.scalar:
+        return result.scalar()
+
+    if result_mode == ResultModes.frame:
+        return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+    rows = result.fetchall()
+    return clean_fetched_values(rows)
+
+
 def clean_fetched_values(results):
     if results:
-        array = np.array(results)
-        assert (
-            len(array.shape) == 2
-        ), f"There are {len(array.shape)} dimensions in the result"
-        if array.shape[0] == 1 and array.shape[1] == 1:
-            return array[0][0]
-        if array.shape[0] > 1 and array.shape[1] == 1:
-            return array.flatten().tolist()
+        if len(results) == 1 and len(results[0]) == 1:
+            return results[0][0]
+        if len(results[0]) == 1:
+            return [row[0] for row in results]
 
-        return array.tolist()
+        return [list(row) for row in results]
 
     return results
 
@@ -187,6 +406,16 @@ def prepare_payload(batch):
 
 
 def get_query_embedding(query, embedding_url, timeout=20):
+    cache = EmbeddingCache()
+    embedding = cache.get(query)
+    if embedding is None:
+        embedding = fetch_query_embedding(query, embedding_url, timeout)
+        if embedding is not None:
+            embedding = cache.set(query, embedding)
+    return embedding
+
+
+def fetch_query_embedding(query, embedding_url, timeout=20):
     try:
         resp = requests.post(embedding_url, json={"data": [query]}, timeout=timeout)
         resp.raise_for_status()